@@ -1,174 +1,261 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import os
-from datetime import datetime
+import re
 from core import (
-    fetch_and_store_single,
+    fetch_and_store_many,
     simulate_admission,
     simulate_contract,
-    export_to_excel,
+    export_results,
     lookup_reg_number,
-    ID_LIST,
-    CONTRACT_ID_LIST
+    lookup_reg_prefix,
+    lookup_reg_numbers,
+    load_directions,
+    admission_state,
+    what_if,
+    simulate_probabilities,
+    has_data,
+    data_version,
+    clear_data,
+    last_published,
+    load_metrics,
+    METRICS_LOG,
+    position_history,
+    cutoff_trend,
+    direction_ids,
+    ensure_catalog,
+    discover_catalog,
+    load_catalog,
+    load_contract_summary,
+    contract_summary_version,
 )
 
-DB_PATH = "abit.db"
-
-def load_budget_data():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    places, names, times = {}, {}, {}
-    for did in ID_LIST:
-        try:
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"places_{did}",))
-            places[did] = int(cur.fetchone()[0])
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"name_{did}",))
-            names[did] = cur.fetchone()[0]
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"time_{did}",))
-            times[did] = cur.fetchone()[0]
-        except:
-            continue
-    conn.close()
-    return places, names, times
-
-def load_contract_data():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    places, names, times = {}, {}, {}
-    for did in CONTRACT_ID_LIST:
-        try:
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"contract_places_{did}",))
-            places[did] = int(cur.fetchone()[0])
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"contract_name_{did}",))
-            names[did] = cur.fetchone()[0]
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"contract_time_{did}",))
-            times[did] = cur.fetchone()[0]
-        except:
-            continue
-    conn.close()
-    return places, names, times
-
-if "budget_loaded" not in st.session_state:
-    if os.path.exists(DB_PATH):
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'applicants_%'")
-        if cur.fetchall():
-            pl, nm, tm = load_budget_data()
-            st.session_state.budget_places = pl
-            st.session_state.budget_names = nm
-            st.session_state.budget_times = tm
-            st.session_state.budget_loaded = True
-        else:
-            st.session_state.budget_loaded = False
-        conn.close()
-    else:
-        st.session_state.budget_loaded = False
-
-if "contract_loaded" not in st.session_state:
-    if os.path.exists(DB_PATH):
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'contract_applicants_%'")
-        if cur.fetchall():
-            pl, nm, tm = load_contract_data()
-            st.session_state.contract_places = pl
-            st.session_state.contract_names = nm
-            st.session_state.contract_times = tm
-            st.session_state.contract_loaded = True
-        else:
-            st.session_state.contract_loaded = False
-        conn.close()
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_directions(version, contract):
+    return load_directions(contract)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_has_data(version, contract):
+    return has_data(contract)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_last_published(version, contract):
+    return last_published(contract)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_budget_simulation(version, budget_places):
+    return simulate_admission(budget_places)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_contract_simulation(version, budget_places, contract_places):
+    budget_adm, _ = cached_budget_simulation(version, budget_places)
+    return simulate_contract(budget_adm, contract_places)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_contract_summary(summary_version):
+    return load_contract_summary()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_export(version, contract, fmt, combined, budget_places, contract_places):
+    if contract:
+        adm = cached_contract_simulation(version, budget_places, contract_places)
     else:
-        st.session_state.contract_loaded = False
+        adm, _ = cached_budget_simulation(version, budget_places)
+    _, names, times = cached_directions(version, contract)
+    return export_results(adm, names, times, fmt, combined)
+
+EXPORT_LABELS = {"xlsx": "Excel", "csv": "CSV", "parquet": "Parquet"}
+
+def export_controls(contract):
+    key = "contract" if contract else "budget"
+    form = "контракт" if contract else "бюджет"
+    col_fmt, col_combined = st.columns(2)
+    fmt = col_fmt.selectbox("Формат выгрузки", list(EXPORT_LABELS), format_func=EXPORT_LABELS.get, key=f"{key}_fmt")
+    combined = col_combined.checkbox("Одним листом", disabled=fmt != "xlsx", key=f"{key}_combined")
+    file_name, data = cached_export(version, contract, fmt, combined or fmt != "xlsx",
+                                    st.session_state.budget_places, st.session_state.contract_places)
+    st.download_button(f"📥 Скачать {EXPORT_LABELS[fmt]} ({form})", data, file_name=file_name)
+
+@st.cache_data(show_spinner=False, max_entries=1024)
+def cached_lookup(version, summary_version, reg):
+    return lookup_reg_number(reg)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_prefix(version, summary_version, prefix):
+    return lookup_reg_prefix(prefix)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_batch(version, summary_version, regs):
+    return lookup_reg_numbers(regs)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def cached_probabilities(version, budget_places, contract_places, runs, seed, p_originals, p_withdraw, p_contract):
+    return simulate_probabilities(budget_places, contract_places, runs=runs, seed=seed, p_originals=p_originals,
+                                  p_withdraw=p_withdraw, p_contract=p_contract)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_position_history(version, reg):
+    return position_history(reg)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_cutoff_trend(version, form, did):
+    return cutoff_trend(form, did)
+
+def show_cutoff_trend(form, names):
+    with st.expander("📈 Динамика проходного балла"):
+        if not names:
+            st.info("Списки ещё не загружались.")
+            return
+        did = st.selectbox("Направление", list(names), format_func=lambda d: f"{d} — {names[d]}", key=f"{form}_trend")
+        trend = cached_cutoff_trend(version, form, did)
+        if not trend:
+            st.info("История по направлению пока не накоплена.")
+            return
+        df = pd.DataFrame(trend).rename(columns={
+            "taken_at": "Время", "rating_time": "Обновление на сайте", "places": "Мест",
+            "applicants": "Заявлений", "originals": "Оригиналов", "cutoff": "Балл последнего на местах"})
+        st.line_chart(df.set_index("Время")[["Балл последнего на местах"]])
+        st.dataframe(df, use_container_width=True)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_catalog(version):
+    return load_catalog()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_metrics(mtime, contract):
+    return load_metrics(contract)
+
+def metrics_mtime():
+    try:
+        return os.path.getmtime(METRICS_LOG)
+    except OSError:
+        return None
+
+def invalidate_cache(message):
+    # Версия данных уже сменилась, но старые записи кэша лучше выбросить сразу
+    st.cache_data.clear()
+    st.session_state.flash = message
+    st.rerun()
+
+version = data_version()
+# Сводку по контракту пересчитывает тот, кто записал данные; до этого она устаревшая
+summary_version = contract_summary_version()
+(st.session_state.budget_places, st.session_state.budget_names,
+ st.session_state.budget_times) = cached_directions(version, False)
+(st.session_state.contract_places, st.session_state.contract_names,
+ st.session_state.contract_times) = cached_directions(version, True)
+st.session_state.budget_loaded = cached_has_data(version, False)
+st.session_state.contract_loaded = cached_has_data(version, True)
 
 st.set_page_config(page_title="Магистерский калькулятор", layout="wide")
 st.title("🎓 Магистерский калькулятор")
 
-tabs = st.tabs(["📥 Бюджет", "📥 Контракт", "🔍 Поиск абитуриента по СНИЛС"])
+flash = st.session_state.pop("flash", None)
+if flash:
+    kind, text = flash
+    getattr(st, kind)(text)
+
+tabs = st.tabs(["📥 Бюджет", "📥 Контракт", "🔍 Поиск абитуриента по СНИЛС", "🩺 Диагностика"])
 
 with tabs[0]:
     st.subheader("Загрузка и симуляция поступления на бюджет")
     if st.session_state.budget_loaded:
         st.info("Данные поступающих на бюджет уже загружены")
+    published = cached_last_published(version, False)
+    if published:
+        st.caption(f"Последняя публикация списков: {published}")
+    budget_incremental = st.checkbox("Обновлять только изменившиеся списки", value=True, key="budget_incremental")
     if st.button("🔄 Загрузить данные (бюджет)"):
         with st.spinner("Загружаем списки поступающих на бюджет..."):
             prog = st.progress(0)
-            places, names, times, fails = {}, {}, {}, []
-            for i, did in enumerate(ID_LIST):
-                res = fetch_and_store_single(did, contract=False)
-                if res:
-                    p, n, t = res
-                    places[did], names[did], times[did] = p, n, t
-                else:
-                    fails.append(did)
-                prog.progress((i+1)/len(ID_LIST))
-            st.session_state.budget_places = places
-            st.session_state.budget_names = names
-            st.session_state.budget_times = times
-            st.session_state.budget_loaded = True
+            ensure_catalog()
+            ids = direction_ids(False)
+            results = fetch_and_store_many(
+                ids, contract=False, incremental=budget_incremental,
+                on_progress=lambda done, total, did, res: prog.progress(done/total))
+            fails = [did for did in ids if not results.get(did)]
         if fails:
-            st.warning(f"Не удалось загрузить списки: {fails}")
+            invalidate_cache(("warning", f"Не удалось загрузить списки: {fails}"))
+        invalidate_cache(("success", "Списки поступающих на бюджет загружены"))
     if st.button("🗑 Очистить данные (бюджет)"):
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
-        st.session_state.budget_loaded = False
-        st.success("Списки поступающих на бюджет очищены")
-    if st.session_state.budget_loaded and st.button("✅ Симулировать (бюджет)"):
-        adm = simulate_admission(st.session_state.budget_places)
-        path = export_to_excel(adm, st.session_state.budget_names, st.session_state.budget_times)
+        clear_data(contract=False)
+        invalidate_cache(("success", "Списки поступающих на бюджет очищены"))
+    if st.button("✅ Симулировать (бюджет)", disabled=not st.session_state.budget_loaded):
+        st.session_state.budget_simulated = True
+    # Флаг, а не состояние кнопки: иначе выбор формата выгрузки скрывал бы результаты
+    if st.session_state.budget_loaded and st.session_state.get("budget_simulated"):
+        adm, cutoffs = cached_budget_simulation(version, st.session_state.budget_places)
         st.success("Симуляция поступления на бюджет завершена")
-        with open(path, "rb") as f:
-            st.download_button("📥 Скачать Excel (бюджет)", f, file_name=os.path.basename(path))
+        export_controls(False)
         for did, lst in adm.items():
             st.subheader(f"{did} — {st.session_state.budget_names[did]}")
+            if cutoffs.get(did) is not None:
+                st.caption(f"Проходной балл: {cutoffs[did]}")
+            else:
+                st.caption("Проходной балл: есть свободные места")
             df = pd.DataFrame(lst, columns=["Регистрационный номер (СНИЛС)", "Баллы", "Приоритет"])
             df.index += 1; df.index.name = "Место"
             st.dataframe(df, use_container_width=True)
+    show_cutoff_trend("budget", st.session_state.budget_names)
 
 with tabs[1]:
     st.subheader("Загрузка и симуляция поступления на контракт")
     if st.session_state.contract_loaded:
         st.info("Данные поступающих на контракт уже загружены")
+    published = cached_last_published(version, True)
+    if published:
+        st.caption(f"Последняя публикация списков: {published}")
+    contract_incremental = st.checkbox("Обновлять только изменившиеся списки", value=True, key="contract_incremental")
     if st.button("🔄 Загрузить данные (контракт)"):
         if not st.session_state.budget_loaded:
             st.warning("Сначала загрузите списки поступающих на бюджет")
         else:
             with st.spinner("Загружаем списки поступающих на контракт..."):
                 prog = st.progress(0)
-                c_places, c_names, c_times, fails = {}, {}, {}, []
-                for i, did in enumerate(CONTRACT_ID_LIST):
-                    res = fetch_and_store_single(did, contract=True)
-                    if res:
-                        p, n, t = res
-                        c_places[did], c_names[did], c_times[did] = p, n, t
-                    else:
-                        fails.append(did)
-                    prog.progress((i+1)/len(CONTRACT_ID_LIST))
-                st.session_state.contract_places = c_places
-                st.session_state.contract_names = c_names
-                st.session_state.contract_times = c_times
-                st.session_state.contract_loaded = True
+                ensure_catalog()
+                ids = direction_ids(True)
+                results = fetch_and_store_many(
+                    ids, contract=True, incremental=contract_incremental,
+                    on_progress=lambda done, total, did, res: prog.progress(done/total))
+                fails = [did for did in ids if not results.get(did)]
             if fails:
-                st.warning(f"Не удалось загрузить списки: {fails}")
+                invalidate_cache(("warning", f"Не удалось загрузить списки: {fails}"))
+            invalidate_cache(("success", "Списки поступающих на контракт загружены"))
     if st.button("🗑 Очистить данные (контракт)"):
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
-        st.session_state.contract_loaded = False
-        st.success("Данные поступающих на контракт очищены")
-    if st.session_state.contract_loaded and st.session_state.budget_loaded and st.button("✅ Симулировать (контракт)"):
-        budget_adm = simulate_admission(st.session_state.budget_places)
-        adm_c = simulate_contract(budget_adm, st.session_state.contract_places)
-        path = export_to_excel(adm_c, st.session_state.contract_names, st.session_state.contract_times)
+        clear_data(contract=True)
+        invalidate_cache(("success", "Данные поступающих на контракт очищены"))
+    if st.session_state.contract_loaded:
+        with st.expander("📊 Сводка по направлениям", expanded=True):
+            # Считается один раз на версию данных и хранится в базе
+            if summary_version != version:
+                st.warning("Сводка посчитана по прошлой версии списков и обновится после их записи.")
+            df = pd.DataFrame(cached_contract_summary(summary_version))
+            if not df.empty:
+                df.insert(1, "name", df["direction_id"].map(st.session_state.contract_names))
+                df = df.rename(columns={
+                    "direction_id": "ID", "name": "Направление", "places": "Мест", "signed": "Договоров",
+                    "admitted": "Проходят", "free_places": "Свободно", "cutoff": "Проходной балл"})
+                st.dataframe(df, use_container_width=True, hide_index=True)
+            st.caption("Бюджет — по числу мест с сайта без учёта оригиналов; проходной балл — по заявлениям без договора и только при заполненных местах.")
+    if st.button("✅ Симулировать (контракт)",
+                 disabled=not (st.session_state.contract_loaded and st.session_state.budget_loaded)):
+        st.session_state.contract_simulated = True
+    if st.session_state.contract_loaded and st.session_state.budget_loaded and st.session_state.get("contract_simulated"):
+        adm_c = cached_contract_simulation(version, st.session_state.budget_places, st.session_state.contract_places)
         st.success("Симуляция поступления на контракт завершена")
-        with open(path, "rb") as f:
-            st.download_button("📥 Скачать Excel (контракт)", f, file_name=os.path.basename(path))
+        export_controls(True)
         for did, lst in adm_c.items():
             st.subheader(f"{did} — {st.session_state.contract_names[did]}")
             df = pd.DataFrame(lst, columns=["Регистрационный номер (СНИЛС)", "Баллы", "Приоритет"])
             df.index += 1; df.index.name = "Место"
             st.dataframe(df, use_container_width=True)
+    show_cutoff_trend("contract", st.session_state.contract_names)
+
+def describe_outcome(outcome):
+    if outcome is None:
+        return "не проходит на бюджет"
+    did, pr, score = outcome
+    return f"{did} — {st.session_state.budget_names.get(did, 'Без названия')} (приоритет {pr}, баллы {score})"
 
 with tabs[2]:
     st.subheader("Поиск абитуриента по его СНИЛС")
@@ -177,10 +264,172 @@ with tabs[2]:
         if not reg.strip():
             st.error("Укажите корректный СНИЛС.")
         else:
-            res = lookup_reg_number(reg.strip())
-            if res:
-                df = pd.DataFrame(res)
-                df.index += 1; df.index.name = "№"
-                st.dataframe(df, use_container_width=True)
-            else:
-                st.info("Ничего не найдено.")
+            # Без точного совпадения ищем по началу номера
+            res = (cached_lookup(version, summary_version, reg.strip())
+                   or cached_prefix(version, summary_version, reg.strip()))
+            regs = {r["Регномер"] for r in res}
+            st.session_state.lookup_reg = regs.pop() if len(regs) == 1 else None
+            st.session_state.lookup_results = res
+    if "lookup_results" in st.session_state:
+        res = st.session_state.lookup_results
+        if res:
+            df = pd.DataFrame(res)
+            df.index += 1; df.index.name = "№"
+            st.dataframe(df, use_container_width=True)
+            if summary_version != version and any(r["Форма"] == "контракт" for r in res):
+                st.caption("Сводка по контракту пересчитывается после записи списков — запас баллов появится позже.")
+        else:
+            st.info("Ничего не найдено.")
+        if res and not st.session_state.lookup_reg:
+            st.info(f"Подходит несколько номеров ({len({r['Регномер'] for r in res})}), уточните СНИЛС.")
+            res = []
+        history = cached_position_history(version, st.session_state.lookup_reg) if res else []
+        if history:
+            with st.expander("🕓 История позиций"):
+                names = {"budget": st.session_state.budget_names, "contract": st.session_state.contract_names}
+                st.dataframe(pd.DataFrame([
+                    {"Время": h["taken_at"],
+                     "ID": h["direction_id"],
+                     "Специальность": names[h["form"]].get(h["direction_id"], "Без названия"),
+                     "Форма": "бюджет" if h["form"] == "budget" else "контракт",
+                     "Позиция": "выбыл" if h["removed"] else h["position"],
+                     "Баллы": h["total_score"],
+                     "Оригинал": h["has_originals"],
+                     "Приоритет": h["priority"]}
+                    for h in history
+                ]), use_container_width=True)
+        budget_rows = [r for r in res if r["Форма"] == "бюджет"]
+        if budget_rows and st.session_state.budget_loaded:
+            st.subheader("🔮 Что если?")
+            options = {f"{r['ID']} — {r['Специальность']}": r for r in budget_rows}
+            with st.form("what_if"):
+                label = st.selectbox("Направление", list(options))
+                new_priority = st.number_input("Новый приоритет", min_value=1, value=1, step=1)
+                withdraw = st.checkbox("Отозвать заявление на это направление")
+                originals = st.checkbox("Подать оригинал документов", value=any(r["Оригинал"] for r in budget_rows))
+                originals_only = st.checkbox("Учитывать только абитуриентов с оригиналами")
+                submitted = st.form_submit_button("Пересчитать")
+            if submitted:
+                chosen = options[label]
+                did, old = chosen["ID"], chosen["Приоритет"]
+                priorities = {did: new_priority}
+                for r in budget_rows:
+                    if r["ID"] == did:
+                        continue
+                    if new_priority <= r["Приоритет"] < old:
+                        priorities[r["ID"]] = r["Приоритет"] + 1
+                    elif old < r["Приоритет"] <= new_priority:
+                        priorities[r["ID"]] = r["Приоритет"] - 1
+                state = admission_state(st.session_state.budget_places, originals_only)
+                result = what_if(st.session_state.lookup_reg, priorities=priorities, originals=originals,
+                                 withdraw=[did] if withdraw else None, state=state)
+                st.write(f"Сейчас: {describe_outcome(result['before'])}")
+                st.write(f"После изменения: {describe_outcome(result['after'])}")
+                if result["changed"]:
+                    st.dataframe(pd.DataFrame([
+                        {"ID": cdid,
+                         "Направление": st.session_state.budget_names.get(cdid, ""),
+                         "Зачислены": ", ".join(ch["added"]),
+                         "Вытеснены": ", ".join(ch["removed"])}
+                        for cdid, ch in result["changed"].items()
+                    ]), use_container_width=True)
+                else:
+                    st.info("Списки зачисленных не изменятся.")
+            with st.expander("🎲 Вероятность поступления"):
+                with st.form("probabilities"):
+                    runs = st.number_input("Число прогонов", min_value=100, max_value=100000, value=2000, step=100)
+                    seed = st.number_input("Зерно генератора", min_value=0, value=0, step=1)
+                    p_originals = st.slider("Вероятность подачи оригинала", 0.0, 1.0, 0.5)
+                    p_withdraw = st.slider("Вероятность отзыва заявлений", 0.0, 1.0, 0.1)
+                    p_contract = st.slider("Вероятность заключения договора", 0.0, 1.0, 0.5)
+                    run_mc = st.form_submit_button("Оценить")
+                if run_mc:
+                    with st.spinner("Моделируем..."):
+                        probs, dists = cached_probabilities(
+                            version, st.session_state.budget_places, st.session_state.contract_places,
+                            int(runs), int(seed), p_originals, p_withdraw, p_contract)
+                    rows = []
+                    for r in res:
+                        form = "budget" if r["Форма"] == "бюджет" else "contract"
+                        dist = dists.get((form, r["ID"]), {})
+                        scores = sorted(s for s in dist if s is not None)
+                        rows.append({
+                            "ID": r["ID"],
+                            "Специальность": r["Специальность"],
+                            "Форма": r["Форма"],
+                            "Вероятность": probs.get((form, r["ID"], st.session_state.lookup_reg), 0.0),
+                            "Проходной балл (мин–макс)": f"{scores[0]}–{scores[-1]}" if scores else "—",
+                            "Доля прогонов с недобором": dist.get(None, 0.0),
+                        })
+                    st.dataframe(pd.DataFrame(rows), use_container_width=True)
+
+    with st.expander("📋 Поиск по списку СНИЛС"):
+        text = st.text_area("СНИЛС, по одному в строке")
+        uploaded = st.file_uploader("или файл со списком", type=["txt", "csv"])
+        if st.button("🔎 Найти всех"):
+            raw = text + "\n" + (uploaded.getvalue().decode("utf-8-sig", errors="ignore") if uploaded else "")
+            batch = tuple(dict.fromkeys(r.strip() for r in re.split(r"[\n;,]", raw) if r.strip()))
+            found = cached_batch(version, summary_version, batch)
+            rows = [{"СНИЛС": r, **app} for r in batch for app in found[r]]
+            missing = [r for r in batch if not found[r]]
+            st.caption(f"Найдено заявлений: {len(rows)} у {len(batch) - len(missing)} из {len(batch)} абитуриентов")
+            if rows:
+                df = pd.DataFrame(rows)
+                st.dataframe(df, use_container_width=True, hide_index=True)
+                st.download_button("📥 Скачать CSV", df.to_csv(index=False, sep=";").encode("utf-8-sig"),
+                                   file_name="lookup.csv")
+            if missing:
+                st.warning(f"Не найдены: {', '.join(missing)}")
+
+STAGE_LABELS = {"dns_s": "DNS", "connect_s": "Соединение", "wait_s": "Ожидание ответа",
+                "download_s": "Скачивание", "parse_s": "Разбор", "db_s": "Запись в базу"}
+
+with tabs[3]:
+    st.subheader("Каталог направлений")
+    catalog = cached_catalog(version)
+    if catalog:
+        counts = {form: sum(1 for c in catalog if c["form"] == form) for form in ("budget", "contract")}
+        st.caption(f"Бюджет: {counts['budget']}, контракт: {counts['contract']}, "
+                   f"последняя проверка: {max(c['last_seen'] for c in catalog)}")
+    else:
+        st.info("Каталог ещё не собран — используются встроенные списки направлений.")
+    if st.button("🔄 Обновить каталог"):
+        with st.spinner("Обходим указатель рейтингов..."):
+            result = discover_catalog()
+        if result["failed"]:
+            invalidate_cache(("warning", f"Не удалось получить страницы указателя: {result['failed']}"))
+        invalidate_cache(("success", f"Каталог обновлён: {result['directions']} направлений, "
+                                     f"удалено {result['removed']}"))
+    st.subheader("Последнее обновление списков")
+    mtime = metrics_mtime()
+    for contract, form in ((False, "Бюджет"), (True, "Контракт")):
+        summary, records = cached_metrics(mtime, contract)
+        st.markdown(f"**{form}**")
+        if summary is None:
+            st.info("Замеров пока нет.")
+            continue
+        names = st.session_state.contract_names if contract else st.session_state.budget_names
+        cols = st.columns(4)
+        cols[0].metric("Начало", summary["started_at"])
+        cols[1].metric("Длительность, с", f"{summary['duration_s']:.1f}")
+        cols[2].metric("Без изменений", f"{summary['unchanged']} из {summary['directions']}")
+        cols[3].metric("С ошибкой", summary["failed"])
+        slowest = sorted(records, key=lambda r: -r["total_s"])[:10]
+        df = pd.DataFrame([
+            {"ID": r["direction_id"], "Направление": names.get(r["direction_id"], ""),
+             "Всего, с": round(r["total_s"], 3),
+             **{label: round(r[key], 3) for key, label in STAGE_LABELS.items()},
+             "КиБ": r["bytes"] // 1024, "Строк": r["rows"], "Повторов": r["retries"]}
+            for r in slowest
+        ])
+        st.caption("Самые медленные направления")
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        failed = [r for r in records if r["status"] == "error"]
+        if failed:
+            st.caption("Ошибки")
+            st.dataframe(pd.DataFrame([
+                {"ID": r["direction_id"], "Направление": names.get(r["direction_id"], ""),
+                 "Этап": r["stage"], "Причина": r["error"], "Попыток": r["attempts"],
+                 "Ответы сервера": "; ".join(r.get("errors", []))}
+                for r in failed
+            ]), use_container_width=True, hide_index=True)
@@ -0,0 +1,73 @@
+import os
+import re
+import random
+
+# Страницы рейтинга для стенда: записанная страница сайта, размноженная в
+# нужное число строк. Номера абитуриентов берутся из общего пула, так что
+# один человек подаёт заявления на несколько направлений, как на сайте.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+ROW_PATTERN = re.compile(r"[ \t]*<tr>\s*<td>.*?</tr>\n?", re.S)
+APPLICATIONS_PER_APPLICANT = 3
+
+_fixtures = {}
+
+def load_fixture(contract=False):
+    name = "contract.html" if contract else "budget.html"
+    if name not in _fixtures:
+        with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+            _fixtures[name] = f.read()
+    return _fixtures[name]
+
+def set_field(html, label, value):
+    # Значение в ячейке вида "<span>Метка:</span> значение</td>"
+    pattern = re.compile(r"(%s:</span>\s*)[^<]*(</)" % r"\xad?".join(map(re.escape, label)))
+    return pattern.sub(lambda m: f"{m.group(1)}{value}{m.group(2)}", html, count=1)
+
+def set_bold(html, label, value):
+    pattern = re.compile(r"(%s\s*<b>)[^<]*(</b>)" % re.escape(label))
+    return pattern.sub(lambda m: f"{m.group(1)}{value}{m.group(2)}", html, count=1)
+
+def reg_pool(size, seed=0):
+    r = random.Random(seed)
+    regs = set()
+    while len(regs) < size:
+        regs.add(f"{r.randint(100, 999):03d}-{r.randint(100, 999)}-{r.randint(100, 999)} {r.randint(10, 99)}")
+    return sorted(regs)
+
+def scale_page(direction_id, contract=False, scale=1, pool=None):
+    # Страница направления в scale раз длиннее записанной: строки шаблона
+    # повторяются с новыми номерами, баллами и приоритетами, позиции
+    # пересчитываются по сумме баллов.
+    html = load_fixture(contract)
+    rows = ROW_PATTERN.findall(html)
+    start = html.index(rows[0])
+    end = html.index(rows[-1]) + len(rows[-1])
+    r = random.Random(direction_id * 2 + contract)
+    n = len(rows) * scale
+    regs = r.sample(pool, n) if pool and len(pool) >= n else reg_pool(n, direction_id)
+    apps = []
+    for i, reg in enumerate(regs):
+        exam = r.randint(40, 100)
+        ind = r.choice((0, 0, 0, 2, 5, 10))
+        apps.append((exam + ind, ind, exam, reg, rows[i % len(rows)]))
+    apps.sort(key=lambda a: (-a[0], -a[1]))
+    out = []
+    for pos, (total, ind, exam, reg, row) in enumerate(apps, 1):
+        row = set_field(row, "Позиция в рейтинге", pos)
+        row = set_field(row, "Регистрационный номер", reg)
+        row = set_field(row, "Сумма оценок", total)
+        row = set_field(row, "Индивидуальные достижения", ind)
+        row = set_field(row, "Предоставлены оригиналы документов", "Да" if r.random() < 0.35 else "Нет")
+        row = set_field(row, "Приоритет", r.randint(1, 5))
+        row = set_field(row, "Вступительные испытания", f"Междисциплинарный экзамен - {exam}")
+        if contract:
+            row = set_field(row, "Тип места", "Заключен договор" if r.random() < 0.3 else "По договору")
+        out.append(row)
+    page = html[:start] + "".join(out) + html[end:]
+    page = set_bold(page, "Направление/Специальность:", f"{direction_id:02d}.04.01 Направление {direction_id}")
+    return page.replace(re.search(r"Всего мест: \d+", page).group(0), f"Всего мест: {5 + direction_id % 20}")
+
+def pool_for(direction_ids, scale=1):
+    rows = len(ROW_PATTERN.findall(load_fixture())) * scale
+    return reg_pool(max(rows, rows * len(direction_ids) // APPLICATIONS_PER_APPLICANT))
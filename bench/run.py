@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import core
+from bench import server
+from bench.pages import scale_page, pool_for
+
+# Офлайн-бенчмарки загрузки, разбора, записи, пересборки из архива, симуляции, выгрузки и поиска.
+#   python -m bench.run --scales 1,10,100 --out bench.json
+#   python -m bench.run --compare bench.json   # код возврата 1 при регрессии
+
+def measure(fn, repeat=3, setup=None):
+    # Время — по repeat прогонам без трассировки, пик памяти — отдельным прогоном
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"runs": repeat, "min": min(times), "median": statistics.median(times),
+            "mean": statistics.mean(times), "peak_kib": peak // 1024}
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(core.__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def reset_simulation():
+    core._admission_state = None
+    core._store = None
+
+def bench_scale(scale, ids, args):
+    results = []
+
+    def record(name, stats, **extra):
+        stats.update({"name": name, "scale": scale}, **extra)
+        results.append(stats)
+        print(f"  {name:<28} медиана {stats['median']:8.3f} с  пик {stats['peak_kib']:>8} КиБ", file=sys.stderr)
+
+    html = scale_page(ids[0], False, scale, pool_for(ids, scale))
+    rows = len(core.parse_page_lxml(html)[3])
+    for backend, parse in core.PARSERS.items():
+        record(f"parse_{backend}", measure(lambda: parse(html), args.repeat), rows=rows)
+
+    stand_in = server.start(ids, scale, args.latency, args.error_rate)
+    core.BASE_URL = stand_in.url
+    with tempfile.TemporaryDirectory() as tmp:
+        core.DB_PATH = os.path.join(tmp, "bench.db")
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            record("fetch_and_store_single", measure(lambda: core.fetch_and_store_single(ids[0]), args.repeat),
+                   rows=rows)
+            for contract in (False, True):
+                form = core.form_name(contract)
+                record(f"fetch_and_store_many_{form}",
+                       measure(lambda: core.fetch_and_store_many(ids, contract, rate=None), args.repeat,
+                               setup=lambda: core.clear_data(contract)),
+                       directions=len(ids))
+                record(f"refresh_unchanged_{form}",
+                       measure(lambda: core.fetch_and_store_many(ids, contract, rate=None, incremental=True),
+                               args.repeat),
+                       directions=len(ids))
+            record("rebuild_from_archive",
+                   measure(lambda: core.rebuild_from_archive(), args.repeat,
+                           setup=lambda: [core.clear_data(contract) for contract in (False, True)]),
+                   directions=2 * len(ids))
+            record("rebuild_from_archive_unchanged", measure(lambda: core.rebuild_from_archive(), args.repeat),
+                   directions=2 * len(ids))
+            budget_places, _, _ = core.load_directions(False)
+            contract_places, names, times = core.load_directions(True)
+            record("simulate_admission", measure(lambda: core.simulate_admission(budget_places), args.repeat,
+                                                 setup=reset_simulation))
+            admitted, _ = core.simulate_admission(budget_places)
+            record("simulate_probabilities",
+                   measure(lambda: core.simulate_probabilities(budget_places, contract_places, runs=200, workers=1),
+                           args.repeat),
+                   runs=200)
+            record("simulate_contract", measure(lambda: core.simulate_contract(admitted, contract_places),
+                                                args.repeat))
+            contract_admitted = core.simulate_contract(admitted, contract_places)
+            record("refresh_contract_summary", measure(core.refresh_contract_summary, args.repeat))
+            record("export_to_excel", measure(lambda: core.export_to_excel(contract_admitted, names, times),
+                                              args.repeat),
+                   rows=sum(len(v) for v in contract_admitted.values()))
+            conn = core.get_connection()
+            regs = [reg for reg, in conn.execute(
+                "SELECT DISTINCT reg_number FROM applicants ORDER BY reg_number LIMIT ?", (args.lookups,))]
+            conn.close()
+            record("lookup_reg_number", measure(lambda: [core.lookup_reg_number(reg) for reg in regs], args.repeat),
+                   lookups=len(regs))
+        finally:
+            os.chdir(cwd)
+            stand_in.shutdown()
+            stand_in.server_close()
+    return results, {"requests": stand_in.requests, "errors": stand_in.errors}
+
+def compare(report, baseline, threshold):
+    # Регрессия — медиана выросла больше чем в threshold раз
+    base = {(r["name"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        old = base.get((r["name"], r["scale"]))
+        if old and old["median"] > 0 and r["median"] / old["median"] > threshold:
+            regressions.append({"name": r["name"], "scale": r["scale"], "baseline": old["median"],
+                                "median": r["median"], "ratio": r["median"] / old["median"]})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки без доступа к abit.susu.ru")
+    parser.add_argument("--scales", default="1,10,100", help="множители длины страниц через запятую")
+    parser.add_argument("--directions", type=int, default=20, help="число направлений каждой формы")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--lookups", type=int, default=200, help="число СНИЛС для поиска")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка стенда, секунд")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--out", help="файл для JSON-отчёта, по умолчанию stdout")
+    parser.add_argument("--compare", help="JSON-отчёт прошлой версии для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    ids = sorted(set(core.ID_LIST) & set(core.CONTRACT_ID_LIST))[:args.directions]
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parser_backend": core.PARSER_BACKEND,
+        "params": vars(args),
+        "results": [],
+        "stand_in": {},
+    }
+    for scale in map(int, args.scales.split(",")):
+        print(f"Масштаб x{scale}", file=sys.stderr)
+        results, stand_in = bench_scale(scale, ids, args)
+        report["results"] += results
+        report["stand_in"][scale] = stand_in
+    regressions = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if regressions:
+        for r in regressions:
+            print(f"Регрессия: {r['name']} x{r['scale']} медленнее в {r['ratio']:.2f} раза", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
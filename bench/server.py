@@ -0,0 +1,115 @@
+import argparse
+import hashlib
+import random
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bench.pages import scale_page, pool_for
+
+# Локальная замена abit.susu.ru: отдаёт указатель /rating/ и страницы
+# /rating/?type=...&id=... из pages.py, с задержкой и долей ошибок 503.
+#   python -m bench.server --port 8765 --scale 10 --latency 0.05 --error-rate 0.02
+
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, direction_ids, scale=1, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(address, Handler)
+        self.direction_ids = direction_ids
+        self.scale = scale
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.pool = pool_for(direction_ids, scale)
+        self.pages = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def page(self, direction_id, contract):
+        key = (direction_id, contract)
+        if key not in self.pages:
+            body = scale_page(direction_id, contract, self.scale, self.pool).encode("utf-8")
+            self.pages[key] = body, '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        return self.pages[key]
+
+    def index(self, page):
+        # Указатель рейтингов: на первой странице бюджет, на второй контракт
+        contract = page == 2
+        links = "\n".join(
+            f'<li><a href="/rating/?type={"blue" if contract else "yellow"}&id={did}">Направление {did}</a></li>'
+            for did in self.direction_ids)
+        other = "" if contract else '<a href="/rating/?page=2">Договорная основа</a>'
+        body = (f"<html><body><h2>Бакалавриат</h2><ul><li><a href=\"/rating/?type=yellow&id=9999\">Б</a></li></ul>"
+                f"<h2>Магистратура</h2><ul>{links}</ul>{other}</body></html>").encode("utf-8")
+        return body, '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        with server.lock:
+            server.requests += 1
+            fail = server.random.random() < server.error_rate
+            if fail:
+                server.errors += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            self.send_error(503)
+            return
+        try:
+            if "id" not in query:
+                body, etag = server.index(int(query.get("page", ["1"])[0]))
+            else:
+                direction_id = int(query["id"][0])
+                contract = query["type"][0] == "blue"
+                with server.lock:
+                    body, etag = server.page(direction_id, contract)
+        except (KeyError, ValueError):
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start(direction_ids, scale=1, latency=0.0, error_rate=0.0, host="127.0.0.1", port=0):
+    server = StandIn((host, port), direction_ids, scale, latency, error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    import core
+    parser = argparse.ArgumentParser(description="Локальная замена abit.susu.ru для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scale", type=int, default=1, help="во сколько раз страницы длиннее записанных")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунд")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    args = parser.parse_args()
+    server = StandIn((args.host, args.port), sorted(set(core.ID_LIST) | set(core.CONTRACT_ID_LIST)),
+                     args.scale, args.latency, args.error_rate)
+    print(f"Стенд запущен: {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
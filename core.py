@@ -1,16 +1,40 @@
 import requests
 import sqlite3
 from bs4 import BeautifulSoup
+import lxml.html
 import re
 import time
-import pandas as pd
+import hashlib
+import gzip
+import heapq
+import bisect
+import random
+import threading
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import Counter
 import os
-from datetime import datetime
+import urllib.parse
+import socket
+import json
+import io
+import csv
+import itertools
+import numpy as np
+import tempfile
+from contextlib import contextmanager
+from array import array
+from openpyxl import Workbook
+from datetime import datetime, timedelta
 
 DB_PATH = "abit.db"
 BASE_URL = "https://abit.susu.ru"
 HEADERS = {"User-Agent": "Mozilla/5.0"}
+# Списки направлений на случай, когда каталог ещё не собран и сайт недоступен
 ID_LIST = [2, 7, 8, 9, 11, 12, 13, 45, 48, 59, 60, 61, 62, 64, 65, 66, 67, 68, 69, 70,
            82, 83, 84, 85, 86, 87, 88, 93, 94, 97, 101, 104, 105, 106, 107, 109, 111,
            112, 114, 116, 118, 136, 147, 149, 172, 179, 180, 183, 184, 189, 212, 213,
@@ -22,26 +46,247 @@ CONTRACT_ID_LIST = [2, 6, 7, 8, 9, 10, 11, 12, 13, 44, 45, 47, 48, 58, 59, 60, 6
                     172, 179, 180, 183, 184, 189, 190, 218, 225, 226, 227, 228, 229,
                     230, 245, 246, 247, 248, 249, 252, 256, 257, 258, 259, 260, 284,
                     324, 325, 326]
+PARSER_BACKEND = os.environ.get("ABIT_PARSER", "lxml")  # "lxml" или "bs4"
+MAX_WORKERS = 8
+RATE_LIMIT = 10  # запросов в секунду на весь процесс, None — без ограничения
+MAX_BACKOFF = 30
+DB_TIMEOUT = 30  # секунд ожидания блокировки записи
+SCHEMA_VERSION = 2  # увеличивать при изменении init_db
+SNAPSHOT_KEYFRAME_EVERY = 24  # каждая n-я версия списка хранится целиком
+SNAPSHOT_KEEP_DAYS = 7  # за последние дни хранятся все версии, раньше — последняя за день
+SNAPSHOT_MAX_AGE_DAYS = None  # версии старше удаляются, None — хранить всегда
+MC_BATCH = 256  # прогонов Монте-Карло, которые считаются одним массивом
+METRICS_LOG = os.environ.get("ABIT_METRICS_LOG", "metrics.jsonl")  # пустая строка — не писать
+METRICS_LOG_MAX_BYTES = 5 * 1024 * 1024
+ARCHIVE_DIR = os.environ.get("ABIT_ARCHIVE", "archive")  # сжатые страницы рейтинга, пустая строка — не хранить
+STAGES = ("dns_s", "connect_s", "wait_s", "download_s", "parse_s", "db_s")
+CATALOG_INDEX_PATH = "/rating/"
+CATALOG_TTL = timedelta(hours=24)
+CATALOG_MAX_PAGES = 200
+# Уровни — регулярные выражения, совпадают только целыми словами: «спо» не
+# находится в «транспорте», «магистр» — в «магистральном»
+CATALOG_LEVEL = r"магистр(?:атур\w*|ант\w*|ов|ы|а)?"  # направления других уровней в каталог не попадают
+CATALOG_OTHER_LEVELS = (r"бакалавр\w*", r"специалитет\w*", r"аспирант\w*", r"ординатур\w*", r"колледж\w*", "спо")
+FORM_TYPES = {"yellow": "budget", "blue": "contract"}
+RATING_TIME_FORMATS = ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y")
 
-def safe_get(url, headers, retries=5, delay=1):
-    for _ in range(retries):
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+_rate_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_archive_lock = threading.Lock()
+_init_lock = threading.Lock()
+_next_request_at = 0.0
+
+_stage_stats = threading.local()
+
+def add_stat(stats, key, value):
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + value
+
+class _TimedConnection:
+    # Время разрешения имени и установки соединения для текущей страницы:
+    # адрес резолвится здесь, а urllib3 подключается уже к IP. Для HTTPS
+    # в connect входит и рукопожатие TLS. Переиспользованные из пула
+    # соединения сюда не попадают.
+    def _new_conn(self):
+        stats = getattr(_stage_stats, "current", None)
+        started = time.perf_counter()
+        try:
+            infos = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            return super()._new_conn()
+        add_stat(stats, "dns_s", time.perf_counter() - started)
+        add_stat(stats, "connections", 1)
+        host = self._dns_host
+        error = None
+        try:
+            for address in dict.fromkeys(info[4][0] for info in infos):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError as e:
+                    error = e
+        finally:
+            self._dns_host = host
+        raise error
+
+    def connect(self):
+        stats = getattr(_stage_stats, "current", None)
+        dns = stats.get("dns_s", 0) if stats is not None else 0
+        started = time.perf_counter()
+        super().connect()
+        if stats is not None:
+            add_stat(stats, "connect_s", time.perf_counter() - started - (stats.get("dns_s", 0) - dns))
+
+class TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+def get_session(pool_size=None):
+    # Пул соединений не меньше числа потоков, иначе лишние соединения
+    # закрываются после каждого запроса; при большем pool_size адаптер заменяется
+    global _session, _session_pool_size
+    pool_size = max(pool_size or 0, MAX_WORKERS)
+    with _session_lock:
+        if _session is None or pool_size > _session_pool_size:
+            session = _session or requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+            adapter.poolmanager.pool_classes_by_scheme = {
+                "http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session, _session_pool_size = session, pool_size
+    return _session
+
+def wait_rate_limit(rate):
+    global _next_request_at
+    if not rate:
+        return
+    with _rate_lock:
+        now = time.monotonic()
+        slot = max(now, _next_request_at)
+        _next_request_at = slot + 1 / rate
+    if slot > now:
+        time.sleep(slot - now)
+
+def safe_get(url, headers, retries=5, delay=1, rate=None, stats=None):
+    # В stats копятся попытки, время по стадиям, размер ответа и причины ошибок
+    error = None
+    for attempt in range(retries):
+        wait_rate_limit(rate)
+        add_stat(stats, "attempts", 1)
+        _stage_stats.current = stats
+        started = time.perf_counter()
+        before = stats.get("dns_s", 0) + stats.get("connect_s", 0) if stats is not None else 0
         try:
-            resp = requests.get(url, headers=headers, timeout=10)
-            resp.raise_for_status()
+            resp = get_session().get(url, headers=headers, timeout=10, stream=True)
+            if stats is not None:
+                after = stats.get("dns_s", 0) + stats.get("connect_s", 0)
+                add_stat(stats, "wait_s", time.perf_counter() - started - (after - before))
+                stats["http_status"] = resp.status_code
+            if resp.status_code >= 400:
+                resp.close()
+                resp.raise_for_status()
+            started = time.perf_counter()
+            add_stat(stats, "bytes", len(resp.content))
+            add_stat(stats, "download_s", time.perf_counter() - started)
             return resp
-        except RequestException:
-            time.sleep(delay)
-    raise RuntimeError(f"Не удалось получить {url}")
+        except RequestException as e:
+            error = e
+            if stats is not None:
+                stats.setdefault("errors", []).append(describe_error(e))
+            if attempt + 1 < retries:
+                backoff = min(delay * 2 ** attempt, MAX_BACKOFF)
+                time.sleep(backoff + random.uniform(0, delay))
+        finally:
+            _stage_stats.current = None
+    raise RuntimeError(f"Не удалось получить {url}: {describe_error(error)}")
+
+def describe_error(error):
+    text = str(error).strip()
+    return f"{type(error).__name__}: {text}" if text else type(error).__name__
+
+APPLICANT_COLUMNS = ("position, reg_number, place_type, total_score, individual_achievements, "
+                     "has_originals, priority, exam_result")
+REG_SEPARATORS = "- .\u00a0\t"  # СНИЛС пишут и с разделителями, и без
+REG_TRIM = "\r\n\v\f"  # остатки переводов строк по краям
+
+def reg_norm_sql(column):
+    # То же, что normalize_reg, но выражением SQLite
+    for sep in REG_SEPARATORS:
+        column = f"replace({column}, '{sep}', '')"
+    return f"trim({column}, char({', '.join(str(ord(c)) for c in REG_TRIM)}))"
+
+REG_NORM_COLUMN = f"reg_norm TEXT GENERATED ALWAYS AS ({reg_norm_sql('reg_number')}) VIRTUAL"
+LEGACY_TABLE_PATTERN = re.compile(r"(contract_)?applicants_(\d+)")
+LEGACY_META_PATTERN = re.compile(r"(contract_)?(name|time|places)_(\d+)")
+LEGACY_META_COLUMNS = {"name": "name", "time": "update_time", "places": "places"}
 
 def get_connection():
-    return sqlite3.connect(DB_PATH)
+    # WAL: читатели видят последнюю опубликованную версию и не ждут писателя.
+    # Схема и перенос старых таблиц — только если версия схемы в файле
+    # (PRAGMA user_version) меньше SCHEMA_VERSION, а не при каждом соединении.
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        with _init_lock:
+            conn.execute("PRAGMA journal_mode=WAL")
+            migrated = init_db(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if migrated:
+            ensure_contract_summary()  # перенос старых таблиц меняет данные
+    return conn
 
-def ensure_table_exists(conn, table_name):
+def init_db(conn):
     cur = conn.cursor()
-    cur.execute(f"""
-        CREATE TABLE IF NOT EXISTS {table_name} (
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS applicants (
+            form TEXT NOT NULL,
+            direction_id INTEGER NOT NULL,
             position INTEGER,
-            reg_number TEXT,
+            reg_number TEXT NOT NULL,
+            place_type TEXT,
+            total_score INTEGER,
+            individual_achievements INTEGER,
+            has_originals BOOLEAN,
+            priority INTEGER,
+            exam_result TEXT,
+            PRIMARY KEY (form, direction_id, reg_number)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_applicants_rank ON applicants (direction_id, priority, total_score)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS directions (
+            form TEXT NOT NULL,
+            direction_id INTEGER NOT NULL,
+            name TEXT,
+            update_time TEXT,
+            places INTEGER,
+            PRIMARY KEY (form, direction_id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            form TEXT,
+            direction_id INTEGER,
+            update_time TEXT,
+            content_hash TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            PRIMARY KEY (form, direction_id)
+        )
+    """)
+    cur.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS snapshots (
+            snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            form TEXT NOT NULL,
+            direction_id INTEGER NOT NULL,
+            rating_time TEXT,
+            taken_at TEXT,
+            fetched_at TEXT,
+            places INTEGER,
+            applicants INTEGER,
+            originals INTEGER,
+            cutoff INTEGER,
+            is_full BOOLEAN
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_rows (
+            snapshot_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            position INTEGER,
+            reg_number TEXT NOT NULL,
             place_type TEXT,
             total_score INTEGER,
             individual_achievements INTEGER,
@@ -50,18 +295,163 @@ def ensure_table_exists(conn, table_name):
             exam_result TEXT
         )
     """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog (
+            form TEXT NOT NULL,
+            direction_id INTEGER NOT NULL,
+            name TEXT,
+            level TEXT,
+            source_url TEXT,
+            first_seen TEXT,
+            last_seen TEXT,
+            PRIMARY KEY (form, direction_id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_pages (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            checked_at TEXT,
+            entries TEXT,
+            links TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS contract_summary (
+            direction_id INTEGER PRIMARY KEY,
+            places INTEGER,
+            signed INTEGER,
+            admitted INTEGER,
+            free_places INTEGER,
+            cutoff INTEGER
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS contract_margins (
+            direction_id INTEGER NOT NULL,
+            reg_number TEXT NOT NULL,
+            fill_rank INTEGER,
+            admitted BOOLEAN,
+            margin INTEGER,
+            PRIMARY KEY (direction_id, reg_number)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_contract_margins_reg ON contract_margins (reg_number)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_direction ON snapshots (form, direction_id, taken_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_rows_id ON snapshot_rows (snapshot_id)")
+    # Нормализованный номер в истории позиций — вычисляемый столбец с индексом:
+    # SQLite сам обновляет индекс при каждой записи. Текущие списки ищутся по
+    # хранилищу в памяти, поэтому в applicants столбца и индекса больше нет.
+    # Столбец со старым выражением пересоздаётся.
+    cur.execute("DROP INDEX IF EXISTS idx_applicants_reg")
+    cur.execute("DROP INDEX IF EXISTS idx_snapshot_rows_reg")
+    cur.execute("DROP INDEX IF EXISTS idx_applicants_reg_norm")
+    if "reg_norm" in {row[1] for row in cur.execute("PRAGMA table_xinfo(applicants)")}:
+        cur.execute("ALTER TABLE applicants DROP COLUMN reg_norm")
+    columns = {row[1] for row in cur.execute("PRAGMA table_xinfo(snapshot_rows)")}
+    table_sql = cur.execute("SELECT sql FROM sqlite_master WHERE name = 'snapshot_rows'").fetchone()[0]
+    if "reg_norm" in columns and REG_NORM_COLUMN not in table_sql:
+        cur.execute("DROP INDEX IF EXISTS idx_snapshot_rows_reg_norm")
+        cur.execute("ALTER TABLE snapshot_rows DROP COLUMN reg_norm")
+        columns.discard("reg_norm")
+    if "reg_norm" not in columns:
+        cur.execute(f"ALTER TABLE snapshot_rows ADD COLUMN {REG_NORM_COLUMN}")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_rows_reg_norm ON snapshot_rows (reg_norm)")
+    conn.commit()
+    cur.close()
+    migrated = migrate_legacy_tables(conn)
+    seed_snapshots(conn)
+    return migrated
+
+def migrate_legacy_tables(conn):
+    # Старые базы хранили по таблице applicants_<id> / contract_applicants_<id>
+    # на направление и метаданные строками в metadata — переносим их в общую схему.
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    legacy = [(t, LEGACY_TABLE_PATTERN.fullmatch(t)) for t, in cur.fetchall()]
+    legacy = [(t, m) for t, m in legacy if m]
+    cur.execute("SELECT key, value FROM metadata WHERE key GLOB '*_[0-9]*'")
+    meta = [(LEGACY_META_PATTERN.fullmatch(k), v) for k, v in cur.fetchall()]
+    meta = [(m, v) for m, v in meta if m]
+    if not legacy and not meta:
+        cur.close()
+        return False
+    for table, m in legacy:
+        cur.execute(
+            f"INSERT OR REPLACE INTO applicants (form, direction_id, {APPLICANT_COLUMNS}) "
+            f"SELECT ?, ?, {APPLICANT_COLUMNS} FROM {table} WHERE reg_number IS NOT NULL",
+            (form_name(m.group(1)), int(m.group(2))))
+        cur.execute(f"DROP TABLE {table}")
+    for m, value in meta:
+        form, did = form_name(m.group(1)), int(m.group(3))
+        column = LEGACY_META_COLUMNS[m.group(2)]
+        cur.execute("INSERT OR IGNORE INTO directions (form, direction_id) VALUES (?, ?)", (form, did))
+        cur.execute(f"UPDATE directions SET {column} = ? WHERE form = ? AND direction_id = ?",
+                    (int(value) if column == "places" else value, form, did))
+        cur.execute("DELETE FROM metadata WHERE key = ?", (m.group(0),))
+    bump_data_version(cur)
+    conn.commit()
+    cur.close()
+    return True
+
+def seed_snapshots(conn):
+    # Направления, загруженные до появления истории, получают полную версию из текущих списков
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT form, direction_id, update_time, places FROM directions d
+        WHERE NOT EXISTS (SELECT 1 FROM snapshots s WHERE s.form = d.form AND s.direction_id = d.direction_id)
+    """)
+    missing = cur.fetchall()
+    for form, did, update_time, places in missing:
+        cur.execute(f"SELECT {APPLICANT_COLUMNS} FROM applicants WHERE form = ? AND direction_id = ?", (form, did))
+        rows = cur.fetchall()
+        if rows:
+            record_snapshot(cur, form, did, update_time, places or 0, rows, (rows, [], []))
     conn.commit()
     cur.close()
 
-def convert_page_to_soup(url, headers):
-    resp = safe_get(url, headers)
+def data_version(conn=None):
+    # Счётчик версии данных: меняется при каждой записи, на нём держатся кэши приложения
+    own = conn is None
+    conn = conn or get_connection()
+    row = conn.execute("SELECT value FROM metadata WHERE key = 'data_version'").fetchone()
+    if own:
+        conn.close()
+    return int(row[0]) if row else 0
+
+def bump_data_version(cur):
+    cur.execute("""
+        INSERT INTO metadata (key, value) VALUES ('data_version', 1)
+        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    """)
+
+def clear_data(contract=False):
+    form = form_name(contract)
+    conn = get_connection()
+    cur = conn.cursor()
+    for table in ("applicants", "directions", "fingerprints"):
+        cur.execute(f"DELETE FROM {table} WHERE form = ?", (form,))
+    bump_data_version(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+    ensure_contract_summary()
+
+PLACES_PATTERN = re.compile(r"Всего мест:\s*(\d+)")
+TD_PATTERN = re.compile(r"(.+?):\s*(.+)")
+CLASS_XPATH = "//div[contains(concat(' ', normalize-space(@class), ' '), ' {} ')]"
+
+def convert_page_to_soup(url, headers, rate=None):
+    resp = safe_get(url, headers, rate=rate)
     return BeautifulSoup(resp.text, "html.parser")
 
 def extract_budget_places(soup):
     for b in soup.find_all("b"):
         text = b.get_text(strip=True)
         if "Всего мест:" in text:
-            m = re.search(r"Всего мест:\s*(\d+)", text)
+            m = PLACES_PATTERN.search(text)
             if m:
                 return int(m.group(1))
     return 0
@@ -91,7 +481,7 @@ def extract_table_body_from_soup(soup):
 
 def parse_td_content(text):
     text = text.replace("\xad", "")
-    m = re.match(r"(.+?):\s*(.+)", text)
+    m = TD_PATTERN.match(text)
     return (m.group(1).strip(), m.group(2).strip()) if m else (text.strip(), None)
 
 def extract_data_from_table_body(table_body):
@@ -106,6 +496,61 @@ def extract_data_from_table_body(table_body):
             rows.append(row)
     return rows
 
+def stripped_text(el):
+    # То же, что get_text(strip=True) в BeautifulSoup
+    return "".join(t.strip() for t in el.itertext())
+
+def parse_page_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    places = extract_budget_places(soup)
+    name, update_time = extract_direction_metadata(soup)
+    raw = extract_data_from_table_body(extract_table_body_from_soup(soup))
+    return places, name, update_time, [transform_row(r) for r in raw]
+
+def parse_page_lxml(html):
+    root = lxml.html.fromstring(html)
+    places = 0
+    for b in root.iter("b"):
+        text = stripped_text(b)
+        if "Всего мест:" in text:
+            m = PLACES_PATTERN.search(text)
+            if m:
+                places = int(m.group(1))
+                break
+    name = "Без названия"
+    update_time = "неизвестно"
+    info = root.xpath(CLASS_XPATH.format("rating_info"))
+    if info:
+        for p in info[0].iter("p"):
+            if "Направление/Специальность" in p.text_content():
+                b = next(p.iter("b"), None)
+                if b is not None:
+                    name = stripped_text(b)
+    time_block = root.xpath(CLASS_XPATH.format("rating_time"))
+    if time_block:
+        b = next(time_block[0].iter("b"), None)
+        if b is not None:
+            update_time = stripped_text(b)
+    tbl = next(root.iter("table"), None)
+    tbody = next(tbl.iter("tbody"), None) if tbl is not None else None
+    if tbody is None:
+        raise ValueError("Не найдена таблица или tbody")
+    rows = []
+    for tr in tbody.iter("tr"):
+        row = {}
+        for td in tr.iter("td"):
+            k, v = parse_td_content(td.text_content())
+            if v is not None:
+                row[k] = v
+        if row:
+            rows.append(transform_row(row))
+    return places, name, update_time, rows
+
+PARSERS = {"bs4": parse_page_bs4, "lxml": parse_page_lxml}
+
+def parse_page(html, backend=None):
+    return PARSERS[backend or PARSER_BACKEND](html)
+
 def transform_row(row):
     return (
         int(row.get("Позиция в рейтинге", 0)),
@@ -118,161 +563,1617 @@ def transform_row(row):
         row.get("Вступительные испытания", "")
     )
 
-def fetch_and_store_single(direction_id, contract=False):
+def direction_url(direction_id, contract=False):
+    return f"{BASE_URL}/rating/?type={'blue' if contract else 'yellow'}&id={direction_id}"
+
+def form_name(contract):
+    return "contract" if contract else "budget"
+
+def load_fingerprints(conn, contract=False):
+    cur = conn.execute(
+        "SELECT direction_id, update_time, content_hash, etag, last_modified FROM fingerprints WHERE form = ?",
+        (form_name(contract),))
+    return {did: tuple(rest) for did, *rest in cur.fetchall()}
+
+def load_direction_meta(conn, direction_id, contract=False):
+    cur = conn.execute("SELECT places, name, update_time FROM directions WHERE form = ? AND direction_id = ?",
+                       (form_name(contract), direction_id))
+    row = cur.fetchone()
+    return tuple(row) if row else None
+
+def load_directions(contract=False):
+    # Только направления из каталога: закрытые на сайте в симуляцию не попадают
+    conn = get_connection()
+    ids = set(direction_ids(contract, conn))
+    cur = conn.execute("SELECT direction_id, places, name, update_time FROM directions WHERE form = ?",
+                       (form_name(contract),))
+    places, names, times = {}, {}, {}
+    for did, p, n, t in cur.fetchall():
+        if did in ids:
+            places[did], names[did], times[did] = p or 0, n, t
+    conn.close()
+    return places, names, times
+
+def direction_ids(contract=False, conn=None):
+    # Направления формы обучения из сохранённого каталога, без обращения к сайту
+    own = conn is None
+    conn = conn or get_connection()
+    ids = [did for did, in conn.execute(
+        "SELECT direction_id FROM catalog WHERE form = ? ORDER BY direction_id", (form_name(contract),))]
+    if own:
+        conn.close()
+    return ids or list(CONTRACT_ID_LIST if contract else ID_LIST)
+
+def load_catalog(contract=None):
     conn = get_connection()
-    table = ("contract_applicants_" if contract else "applicants_") + str(direction_id)
-    ensure_table_exists(conn, table)
-    url = f"{BASE_URL}/rating/?type={'blue' if contract else 'yellow'}&id={direction_id}"
+    cur = conn.execute(
+        "SELECT form, direction_id, name, level, last_seen FROM catalog WHERE ? IS NULL OR form = ? "
+        "ORDER BY form, direction_id", (None if contract is None else form_name(contract),) * 2)
+    keys = ("form", "direction_id", "name", "level", "last_seen")
+    catalog = [dict(zip(keys, row)) for row in cur.fetchall()]
+    conn.close()
+    return catalog
+
+def catalog_checked_at(conn=None):
+    own = conn is None
+    conn = conn or get_connection()
+    row = conn.execute("SELECT value FROM metadata WHERE key = 'catalog_checked_at'").fetchone()
+    if own:
+        conn.close()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def level_matches(text):
+    # Уровень не указан — оставляем, указан другой — пропускаем
+    text = text.lower()
+    found = lambda level: re.search(rf"\b(?:{level})\b", text)
+    return bool(found(CATALOG_LEVEL) or not any(found(level) for level in CATALOG_OTHER_LEVELS))
+
+def parse_index_page(html, url):
+    # Ссылки на рейтинги направлений и на другие страницы указателя. Уровень
+    # берётся из ближайшего заголовка над ссылкой.
+    root = lxml.html.fromstring(html)
+    root.make_links_absolute(url)
+    base = urllib.parse.urlparse(BASE_URL)
+    entries, links = [], []
+    heading = ""
+    for el in root.iter():
+        if el.tag in ("h1", "h2", "h3", "h4", "h5"):
+            heading = stripped_text(el)
+            continue
+        if el.tag != "a" or not el.get("href"):
+            continue
+        href = urllib.parse.urldefrag(el.get("href"))[0]
+        parsed = urllib.parse.urlparse(href)
+        if parsed.netloc != base.netloc or not parsed.path.startswith(CATALOG_INDEX_PATH):
+            continue
+        query = urllib.parse.parse_qs(parsed.query)
+        if "id" in query:
+            form = FORM_TYPES.get(query.get("type", [""])[0])
+            name = " ".join(el.text_content().split())
+            if form and query["id"][0].isdigit() and level_matches(f"{heading} {name}"):
+                entries.append((form, int(query["id"][0]), name or None, heading or None))
+        else:
+            links.append(href)
+    return entries, links
+
+def fetch_index_page(url, cached=None, rate=None):
+    # Возвращает (etag, last_modified, хеш, записи, ссылки, изменилась ли страница)
+    headers = dict(HEADERS)
+    if cached:
+        etag, last_modified = cached[:2]
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    resp = safe_get(url, headers, retries=3, rate=rate)
+    if cached and resp.status_code == 304:
+        return cached + (False,)
+    content_hash = hashlib.sha256(resp.content).hexdigest()
+    if cached and cached[2] == content_hash:
+        return cached + (False,)
+    entries, links = parse_index_page(resp.text, url)
+    return resp.headers.get("ETag"), resp.headers.get("Last-Modified"), content_hash, entries, links, True
+
+def discover_catalog(workers=MAX_WORKERS, rate=RATE_LIMIT, max_pages=CATALOG_MAX_PAGES):
+    # Обход указателя рейтингов волнами в пуле потоков. Если все страницы
+    # получены, направления, пропавшие с сайта, удаляются из каталога.
+    conn = get_connection()
+    cached = {}
+    for url, etag, last_modified, content_hash, entries, links in conn.execute(
+            "SELECT url, etag, last_modified, content_hash, entries, links FROM catalog_pages"):
+        cached[url] = (etag, last_modified, content_hash,
+                       [tuple(e) for e in json.loads(entries)], json.loads(links))
+    start = BASE_URL + CATALOG_INDEX_PATH
+    seen, frontier = {start}, [start]
+    pages, failed = {}, []
+    get_session(workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while frontier:
+            futures = {pool.submit(fetch_index_page, url, cached.get(url), rate): url for url in frontier}
+            frontier = []
+            for fut in as_completed(futures):
+                url = futures[fut]
+                try:
+                    pages[url] = fut.result()
+                except Exception:
+                    failed.append(url)
+                    continue
+                for link in pages[url][4]:
+                    if link not in seen and len(seen) < max_pages:
+                        seen.add(link)
+                        frontier.append(link)
+    found = {}
+    for url, (_, _, _, entries, _, _) in pages.items():
+        for form, did, name, level in entries:
+            found.setdefault((form, did), (name, level, url))
+    now = datetime.now().isoformat(sep=" ", timespec="seconds")
+    cur = conn.cursor()
+    cur.execute("SELECT form, direction_id, name, level FROM catalog")
+    before = {(form, did): (name, level) for form, did, name, level in cur.fetchall()}
+    cur.executemany(
+        "REPLACE INTO catalog_pages (url, etag, last_modified, content_hash, checked_at, entries, links) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(url, etag, lm, h, now, json.dumps(entries, ensure_ascii=False), json.dumps(links))
+         for url, (etag, lm, h, entries, links, _) in pages.items()])
+    cur.executemany("""
+        INSERT INTO catalog (form, direction_id, name, level, source_url, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (form, direction_id) DO UPDATE SET
+            name = excluded.name, level = excluded.level, source_url = excluded.source_url, last_seen = excluded.last_seen
+    """, [(form, did, name, level, url, now, now) for (form, did), (name, level, url) in found.items()])
+    gone = [key for key in before if key not in found] if not failed and found else []
+    cur.executemany("DELETE FROM catalog WHERE form = ? AND direction_id = ?", gone)
+    if not failed:
+        cur.execute("REPLACE INTO metadata (key, value) VALUES ('catalog_checked_at', ?)", (now,))
+    if gone or any(before.get(key) != (name, level) for key, (name, level, _) in found.items()):
+        bump_data_version(cur)
+    conn.commit()
+    conn.close()
+    ensure_contract_summary()
+    return {"pages": len(pages), "failed": failed, "directions": len(found),
+            "changed": sum(1 for p in pages.values() if p[5]), "removed": len(gone)}
+
+def ensure_catalog(ttl=CATALOG_TTL, workers=MAX_WORKERS, rate=RATE_LIMIT):
+    # Каталог перепроверяется на сайте не чаще раза в ttl; при ошибке
+    # остаётся прежний (или запасные списки ID_LIST / CONTRACT_ID_LIST)
+    checked = catalog_checked_at()
+    if checked and datetime.now() - checked < ttl:
+        return None
     try:
-        soup = convert_page_to_soup(url, HEADERS)
-        places = extract_budget_places(soup)
-        name, update_time = extract_direction_metadata(soup)
-        tbody = extract_table_body_from_soup(soup)
-        raw = extract_data_from_table_body(tbody)
-        rows = [transform_row(r) for r in raw]
-        cur = conn.cursor()
-        cur.execute(f"DELETE FROM {table}")
+        return discover_catalog(workers, rate)
+    except Exception as e:
+        return {"error": describe_error(e)}
+
+def has_data(contract=False):
+    conn = get_connection()
+    row = conn.execute("SELECT 1 FROM applicants WHERE form = ? LIMIT 1", (form_name(contract),)).fetchone()
+    conn.close()
+    return row is not None
+
+def fetch_direction(direction_id, contract=False, rate=None, fingerprint=None, stats=None):
+    # С отпечатком страница запрашивается условно, и если она не изменилась
+    # (304 или тот же хеш содержимого), возвращается None без разбора HTML.
+    headers = dict(HEADERS)
+    if fingerprint:
+        _, _, etag, last_modified = fingerprint
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    stats = stats if stats is not None else {}
+    stats["stage"] = "fetch"
+    resp = safe_get(direction_url(direction_id, contract), headers, rate=rate, stats=stats)
+    if fingerprint and resp.status_code == 304:
+        stats["status"] = "unchanged"
+        return None
+    content_hash = hashlib.sha256(resp.content).hexdigest()
+    if fingerprint and fingerprint[1] == content_hash:
+        stats["status"] = "unchanged"
+        return None
+    archive_page(form_name(contract), direction_id, resp, content_hash)
+    stats["stage"] = "parse"
+    started = time.perf_counter()
+    places, name, update_time, rows = parse_page(resp.text)
+    stats["parse_s"] = time.perf_counter() - started
+    stats["rows"] = len(rows)
+    fingerprint = (update_time, content_hash, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+    return places, name, update_time, rows, fingerprint
+
+def diff_rows(cur, form, direction_id, rows):
+    cur.execute(f"SELECT {APPLICANT_COLUMNS} FROM applicants WHERE form = ? AND direction_id = ?",
+                (form, direction_id))
+    old = {row[1]: row for row in cur.fetchall()}
+    new = {row[1]: row for row in rows}
+    removed = [reg for reg in old if reg not in new]
+    inserted = [row for reg, row in new.items() if reg not in old]
+    updated = [row for reg, row in new.items() if reg in old and old[reg] != row]
+    return inserted, updated, removed
+
+def apply_row_diff(cur, form, direction_id, diff):
+    inserted, updated, removed = diff
+    key = (form, direction_id)
+    cur.executemany("DELETE FROM applicants WHERE form = ? AND direction_id = ? AND reg_number = ?",
+                    [key + (reg,) for reg in removed])
+    cur.executemany(
+        "UPDATE applicants SET position = ?, place_type = ?, total_score = ?, individual_achievements = ?, "
+        "has_originals = ?, priority = ?, exam_result = ? WHERE form = ? AND direction_id = ? AND reg_number = ?",
+        [row[:1] + row[2:] + key + row[1:2] for row in updated]
+    )
+    cur.executemany(
+        f"INSERT INTO applicants (form, direction_id, {APPLICANT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [key + row for row in inserted]
+    )
+    return len(inserted), len(updated), len(removed)
+
+def store_direction(conn, direction_id, contract, data, incremental=False, commit=True):
+    places, name, update_time, rows, fingerprint = data
+    form = form_name(contract)
+    cur = conn.cursor()
+    diff = diff_rows(cur, form, direction_id, rows)
+    if incremental:
+        apply_row_diff(cur, form, direction_id, diff)
+    else:
+        cur.execute("DELETE FROM applicants WHERE form = ? AND direction_id = ?", (form, direction_id))
         cur.executemany(
-            f"INSERT INTO {table} (position, reg_number, place_type, total_score, individual_achievements, has_originals, priority, exam_result) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            rows
+            f"INSERT OR REPLACE INTO applicants (form, direction_id, {APPLICANT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(form, direction_id) + row for row in rows]
         )
-        cur.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)")
-        meta = [
-            (f"{'contract_' if contract else ''}name_{direction_id}", name),
-            (f"{'contract_' if contract else ''}time_{direction_id}", update_time),
-            (f"{'contract_' if contract else ''}places_{direction_id}", str(places))
-        ]
-        for k, v in meta:
-            cur.execute("REPLACE INTO metadata (key, value) VALUES (?, ?)", (k, v))
+    record_snapshot(cur, form, direction_id, update_time, places, rows, diff)
+    cur.execute("REPLACE INTO directions (form, direction_id, name, update_time, places) VALUES (?, ?, ?, ?, ?)",
+                (form, direction_id, name, update_time, places))
+    cur.execute("REPLACE INTO fingerprints (form, direction_id, update_time, content_hash, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?)",
+                (form, direction_id) + fingerprint)
+    bump_data_version(cur)
+    if commit:
         conn.commit()
-        cur.close()
-        conn.close()
-        return places, name, update_time
-    except:
+    cur.close()
+    return places, name, update_time
+
+def parse_rating_time(text):
+    for fmt in RATING_TIME_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt).isoformat(sep=" ")
+        except (ValueError, AttributeError):
+            continue
+    return None
+
+def rating_cutoff(rows, places):
+    # Балл абитуриента на последнем месте по позиции в рейтинге
+    ranked = sorted(rows, key=lambda r: r[0])
+    return ranked[places - 1][3] if 0 < places <= len(ranked) else None
+
+def record_snapshot(cur, form, direction_id, update_time, places, rows, diff):
+    # Версия списка хранится разницей с предыдущей; каждая SNAPSHOT_KEYFRAME_EVERY-я
+    # и первая после очистки — полной копией, чтобы восстановление было быстрым.
+    inserted, updated, removed = diff
+    cur.execute("SELECT MAX(snapshot_id) FROM snapshots WHERE form = ? AND direction_id = ? AND is_full = 1",
+                (form, direction_id))
+    last_full = cur.fetchone()[0]
+    since_full = 0
+    if last_full is not None:
+        cur.execute("SELECT COUNT(*) FROM snapshots WHERE form = ? AND direction_id = ? AND snapshot_id > ?",
+                    (form, direction_id, last_full))
+        since_full = cur.fetchone()[0]
+    full = (last_full is None or since_full + 1 >= SNAPSHOT_KEYFRAME_EVERY
+            or (len(inserted) == len(rows) and not updated and not removed))
+    now = datetime.now().isoformat(sep=" ", timespec="seconds")
+    cur.execute("""
+        INSERT INTO snapshots (form, direction_id, rating_time, taken_at, fetched_at, places, applicants, originals, cutoff, is_full)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (form, direction_id, update_time, parse_rating_time(update_time) or now, now, places, len(rows),
+          sum(1 for r in rows if r[5]), rating_cutoff(rows, places), int(full)))
+    sid = cur.lastrowid
+    # Выбывшие отмечаются и в полной копии, иначе история позиций их не увидит
+    changes = [(sid, "I") + row for row in rows] if full else \
+        [(sid, "I") + row for row in inserted] + [(sid, "U") + row for row in updated]
+    changes += [(sid, "D", None, reg) + (None,) * 6 for reg in removed]
+    cur.executemany(
+        f"INSERT INTO snapshot_rows (snapshot_id, op, {APPLICANT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        changes
+    )
+    return sid
+
+def _replay(cur, snapshots):
+    # Восстанавливает состояние после каждой версии из списка (snapshot_id, is_full)
+    # по порядку; полная копия начинает состояние заново
+    cur.execute(
+        f"SELECT snapshot_id, op, {APPLICANT_COLUMNS} FROM snapshot_rows "
+        f"WHERE snapshot_id IN (SELECT value FROM json_each(?)) ORDER BY snapshot_id",
+        (json.dumps([sid for sid, _ in snapshots]),))
+    by_snapshot = {}
+    for sid, op, *row in cur.fetchall():
+        by_snapshot.setdefault(sid, []).append((op, tuple(row)))
+    state = {}
+    for sid, is_full in snapshots:
+        if is_full:
+            state = {}
+        for op, row in by_snapshot.get(sid, []):
+            if op == "D":
+                state.pop(row[1], None)
+            else:
+                state[row[1]] = row
+        yield sid, state
+
+def snapshot_state(form, direction_id, at=None):
+    # Список направления на момент at (ISO-строка) или последняя версия
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT snapshot_id FROM snapshots WHERE form = ? AND direction_id = ? AND (? IS NULL OR taken_at <= ?)
+        ORDER BY taken_at DESC, snapshot_id DESC LIMIT 1
+    """, (form, direction_id, at, at))
+    row = cur.fetchone()
+    if row is None:
         conn.close()
-        return None
+        return []
+    target = row[0]
+    cur.execute("SELECT MAX(snapshot_id) FROM snapshots WHERE form = ? AND direction_id = ? AND is_full = 1 AND snapshot_id <= ?",
+                (form, direction_id, target))
+    base = cur.fetchone()[0]
+    cur.execute("SELECT snapshot_id, is_full FROM snapshots WHERE form = ? AND direction_id = ? AND snapshot_id BETWEEN ? AND ? ORDER BY snapshot_id",
+                (form, direction_id, base, target))
+    state = {}
+    for _, state in _replay(cur, cur.fetchall()):
+        pass
+    conn.close()
+    return sorted(state.values(), key=lambda r: r[0])
 
-def simulate_admission(budget_places):
+def position_history(reg_number):
     conn = get_connection()
     cur = conn.cursor()
-    applicants = []
-    for did in ID_LIST:
-        tbl = f"applicants_{did}"
-        cur.execute(f"SELECT reg_number, total_score, priority FROM {tbl}")
-        applicants += [(reg, score, pr, did) for reg, score, pr in cur.fetchall()]
-    applicants.sort(key=lambda x: (x[2], -x[1]))
-    admitted = {}
-    seen = set()
-    for reg, score, pr, did in applicants:
-        if reg in seen:
+    cur.execute("""
+        SELECT s.form, s.direction_id, s.taken_at, s.rating_time, r.op, r.position, r.total_score,
+               r.has_originals, r.priority
+        FROM snapshot_rows r JOIN snapshots s USING (snapshot_id)
+        WHERE r.reg_norm = ?
+        ORDER BY s.taken_at, s.snapshot_id
+    """, (normalize_reg(reg_number),))
+    history = []
+    last = {}
+    for form, did, taken_at, rating_time, op, pos, score, orig, pr in cur.fetchall():
+        entry = (op == "D", pos, score, orig, pr)
+        if last.get((form, did)) == entry:
             continue
-        admitted.setdefault(did, [])
-        if len(admitted[did]) < budget_places.get(did, 0):
-            admitted[did].append((reg, score, pr))
-            seen.add(reg)
-    cur.close()
+        last[form, did] = entry
+        history.append({
+            "form": form, "direction_id": did, "taken_at": taken_at, "rating_time": rating_time,
+            "removed": op == "D", "position": pos, "total_score": score,
+            "has_originals": None if orig is None else bool(orig), "priority": pr,
+        })
     conn.close()
-    return admitted
+    return history
 
-def simulate_contract(budget_admitted, contract_places):
-    banned = {reg for lst in budget_admitted.values() for reg, *_ in lst}
+def cutoff_trend(form, direction_id):
     conn = get_connection()
+    cur = conn.execute("""
+        SELECT taken_at, rating_time, places, applicants, originals, cutoff
+        FROM snapshots WHERE form = ? AND direction_id = ? ORDER BY taken_at, snapshot_id
+    """, (form, direction_id))
+    keys = ("taken_at", "rating_time", "places", "applicants", "originals", "cutoff")
+    trend = [dict(zip(keys, row)) for row in cur.fetchall()]
+    conn.close()
+    return trend
+
+def compact_snapshots(keep_days=SNAPSHOT_KEEP_DAYS, max_age_days=SNAPSHOT_MAX_AGE_DAYS, now=None, conn=None):
+    # Версии младше keep_days хранятся все, старше — по последней за день,
+    # старше max_age_days удаляются. Оставшиеся версии переписываются разницами
+    # между собой, первая становится полной копией.
+    own = conn is None
+    conn = conn or get_connection()
     cur = conn.cursor()
-    admitted = {}
-    for did in CONTRACT_ID_LIST:
-        total = contract_places.get(did, 0)
-        cur.execute(f"SELECT reg_number, total_score, priority, place_type FROM contract_applicants_{did}")
-        rows = [(reg, score, pr, ptype) for reg, score, pr, ptype in cur.fetchall() if reg not in banned]
-        signed = [(reg, score, pr) for reg, score, pr, ptype in rows if 'заключен договор' in ptype.lower()]
-        applied = [(reg, score, pr) for reg, score, pr, ptype in rows if 'подано заявление' in ptype.lower()]
-        admitted[did] = []
-        for item in signed:
-            admitted[did].append(item)
-        free = max(total - len(signed), 0)
-        if free > 0:
-            applied.sort(key=lambda x: (x[2], -x[1]))
-            for reg, score, pr in applied:
-                if len(admitted[did]) < total:
-                    admitted[did].append((reg, score, pr))
-                else:
-                    break
+    now = now or datetime.now()
+    recent = (now - timedelta(days=keep_days)).isoformat(sep=" ")
+    oldest = (now - timedelta(days=max_age_days)).isoformat(sep=" ") if max_age_days else None
+    cur.execute("SELECT DISTINCT form, direction_id FROM snapshots")
+    dropped = 0
+    for form, did in cur.fetchall():
+        cur.execute("SELECT snapshot_id, taken_at, is_full FROM snapshots WHERE form = ? AND direction_id = ? ORDER BY snapshot_id",
+                    (form, did))
+        snaps = cur.fetchall()
+        keep = set()
+        last_of_day = {}
+        for sid, taken_at, _ in snaps:
+            if oldest and taken_at < oldest:
+                continue
+            if taken_at >= recent:
+                keep.add(sid)
+            else:
+                last_of_day[taken_at[:10]] = sid
+        keep.update(last_of_day.values())
+        keep.add(snaps[-1][0])
+        if len(keep) == len(snaps):
+            continue
+        full = {sid: is_full for sid, _, is_full in snaps}
+        rewritten = []
+        previous = None
+        for sid, state in _replay(cur, [(sid, is_full) for sid, _, is_full in snaps]):
+            if sid not in keep:
+                continue
+            if previous is None or full[sid]:
+                rewritten += [(sid, "I") + row for row in state.values()]
+            else:
+                rewritten += [(sid, "I" if reg not in previous else "U") + row
+                              for reg, row in state.items() if previous.get(reg) != row]
+            if previous is not None:
+                rewritten += [(sid, "D", None, reg) + (None,) * 6 for reg in previous if reg not in state]
+            previous = dict(state)
+        ids = [sid for sid, *_ in snaps]
+        cur.execute("DELETE FROM snapshot_rows WHERE snapshot_id BETWEEN ? AND ? AND snapshot_id IN "
+                    "(SELECT snapshot_id FROM snapshots WHERE form = ? AND direction_id = ?)",
+                    (ids[0], ids[-1], form, did))
+        cur.executemany("DELETE FROM snapshots WHERE snapshot_id = ?", [(sid,) for sid in ids if sid not in keep])
+        cur.execute("UPDATE snapshots SET is_full = 1 WHERE snapshot_id = ?", (min(keep),))
+        cur.executemany(
+            f"INSERT INTO snapshot_rows (snapshot_id, op, {APPLICANT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rewritten
+        )
+        dropped += len(snaps) - len(keep)
+    conn.commit()
     cur.close()
+    if own:
+        conn.close()
+    return dropped
+
+def new_stats(direction_id, contract, refresh_id):
+    return {"kind": "direction", "refresh_id": refresh_id, "form": form_name(contract),
+            "direction_id": direction_id, "status": None, "stage": None, "http_status": None,
+            "attempts": 0, "connections": 0, "dns_s": 0.0, "connect_s": 0.0, "wait_s": 0.0,
+            "download_s": 0.0, "bytes": 0, "parse_s": 0.0, "rows": 0, "db_s": 0.0, "error": None}
+
+def fail_stats(stats, error):
+    stats["status"] = "error"
+    stats["error"] = describe_error(error)
+
+def finish_stats(stats):
+    stats["retries"] = max(stats["attempts"] - 1, 0)
+    stats["total_s"] = sum(stats[k] for k in STAGES)
+    stats["status"] = stats["status"] or "ok"
+    if stats["status"] != "error":
+        del stats["stage"]
+    return stats
+
+def new_refresh_id():
+    return datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+def fetch_and_store_single(direction_id, contract=False, incremental=False):
+    conn = get_connection()
+    stats = new_stats(direction_id, contract, new_refresh_id())
+    try:
+        fingerprint = load_fingerprints(conn, contract).get(direction_id) if incremental else None
+        data = fetch_direction(direction_id, contract, fingerprint=fingerprint, stats=stats)
+        if data is None:
+            return load_direction_meta(conn, direction_id, contract)
+        stats["stage"] = "db"
+        started = time.perf_counter()
+        result = store_direction(conn, direction_id, contract, data, incremental)
+        stats["db_s"] = time.perf_counter() - started
+        ensure_contract_summary()
+        return result
+    except Exception as e:
+        fail_stats(stats, e)
+        return None
+    finally:
+        conn.close()
+        write_metrics([finish_stats(stats)])
+
+def fetch_and_store_many(direction_ids, contract=False, workers=MAX_WORKERS, rate=RATE_LIMIT,
+                         on_progress=None, incremental=False):
+    # Страницы качаются и разбираются в пуле потоков и складываются в staged,
+    # затем вызывающий поток публикует все изменения одной транзакцией:
+    # читатели видят либо прежние списки целиком, либо новые целиком.
+    refresh_id = new_refresh_id()
+    started = time.time()
+    stats = {did: new_stats(did, contract, refresh_id) for did in direction_ids}
+    staged = {}
+    conn = get_connection()
+    try:
+        fingerprints = load_fingerprints(conn, contract) if incremental else {}
+        get_session(workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(fetch_direction, did, contract, rate, fingerprints.get(did), stats[did]): did
+                       for did in direction_ids}
+            for done, fut in enumerate(as_completed(futures), 1):
+                did = futures[fut]
+                try:
+                    staged[did] = fut.result()
+                except Exception as e:
+                    fail_stats(stats[did], e)
+                if on_progress:
+                    on_progress(done, len(futures), did, did in staged)
+        results = publish_staged(conn, contract, staged, incremental, stats)
+        compact_snapshots(conn=conn)
+    except Exception as e:
+        for did in staged:
+            fail_stats(stats[did], e)
+        raise
+    finally:
+        conn.close()
+        records = [finish_stats(s) for s in stats.values()]
+        write_metrics(records + [{
+            "kind": "refresh", "refresh_id": refresh_id, "form": form_name(contract),
+            "started_at": datetime.fromtimestamp(started).isoformat(sep=" ", timespec="seconds"),
+            "duration_s": time.time() - started, "incremental": incremental,
+            "directions": len(records), "failed": sum(1 for r in records if r["status"] == "error"),
+            "unchanged": sum(1 for r in records if r["status"] == "unchanged"),
+        }])
+    ensure_contract_summary()
+    return {did: results.get(did) for did in direction_ids}
+
+def publish_staged(conn, contract, staged, incremental=False, stats=None):
+    results = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for did, data in staged.items():
+            if data is None:
+                results[did] = load_direction_meta(conn, did, contract)
+                continue
+            direction_stats = stats[did] if stats else {}
+            direction_stats["stage"] = "db"
+            started = time.perf_counter()
+            conn.execute("SAVEPOINT direction")
+            try:
+                results[did] = store_direction(conn, did, contract, data, incremental, commit=False)
+                conn.execute("RELEASE direction")
+            except Exception as e:
+                conn.execute("ROLLBACK TO direction")
+                conn.execute("RELEASE direction")
+                fail_stats(direction_stats, e)
+                results[did] = None
+            direction_stats["db_s"] = time.perf_counter() - started
+        conn.execute("REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                     (f"published_{form_name(contract)}", datetime.now().isoformat(sep=" ", timespec="seconds")))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+def write_metrics(records, path=None):
+    # JSON-строки по направлениям и итог обновления; при превышении
+    # METRICS_LOG_MAX_BYTES журнал переименовывается в *.1
+    path = path or METRICS_LOG
+    if not path:
+        return
+    with _metrics_lock:
+        try:
+            if os.path.exists(path) and os.path.getsize(path) > METRICS_LOG_MAX_BYTES:
+                os.replace(path, path + ".1")
+            with open(path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+def load_metrics(contract=False, path=None):
+    # Итог и записи по направлениям последнего обновления формы обучения
+    path = path or METRICS_LOG
+    form = form_name(contract)
+    summary, records = None, {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return None, []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("form") != form:
+            continue
+        if record.get("kind") == "refresh":
+            summary = record
+        records.setdefault(record.get("refresh_id"), []).append(record)
+    if summary is None:
+        return None, []
+    return summary, [r for r in records.get(summary["refresh_id"], []) if r.get("kind") == "direction"]
+
+def metrics_text():
+    # Метрики последних обновлений в текстовом формате Prometheus
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    refreshes = [load_metrics(contract) for contract in (False, True)]
+    summaries = [s for s, _ in refreshes if s]
+    directions = [r for _, records in refreshes for r in records]
+    key = lambda r: {"form": r["form"], "direction_id": r["direction_id"]}
+    metric("abit_data_version", "gauge", "Data version counter", [({}, data_version())])
+    metric("abit_refresh_timestamp_seconds", "gauge", "Start of the last refresh",
+           [({"form": s["form"]}, datetime.fromisoformat(s["started_at"]).timestamp()) for s in summaries])
+    metric("abit_refresh_duration_seconds", "gauge", "Duration of the last refresh",
+           [({"form": s["form"]}, round(s["duration_s"], 6)) for s in summaries])
+    metric("abit_refresh_directions", "gauge", "Directions in the last refresh",
+           [({"form": s["form"]}, s["directions"]) for s in summaries])
+    metric("abit_refresh_failed_directions", "gauge", "Directions that failed in the last refresh",
+           [({"form": s["form"]}, s["failed"]) for s in summaries])
+    metric("abit_direction_up", "gauge", "1 if the direction was refreshed or unchanged",
+           [(key(r), int(r["status"] != "error")) for r in directions])
+    metric("abit_direction_stage_seconds", "gauge", "Time spent per stage in the last refresh",
+           [(dict(key(r), stage=stage[:-2]), round(r.get(stage, 0), 6)) for r in directions for stage in STAGES])
+    metric("abit_direction_bytes", "gauge", "Downloaded page size",
+           [(key(r), r.get("bytes", 0)) for r in directions])
+    metric("abit_direction_rows", "gauge", "Parsed rating rows",
+           [(key(r), r.get("rows", 0)) for r in directions])
+    metric("abit_direction_retries", "gauge", "HTTP retries in the last refresh",
+           [(key(r), r.get("retries", 0)) for r in directions])
+    return "\n".join(lines) + "\n"
+
+def last_published(contract=False):
+    conn = get_connection()
+    row = conn.execute("SELECT value FROM metadata WHERE key = ?", (f"published_{form_name(contract)}",)).fetchone()
     conn.close()
+    return row[0] if row else None
+
+def archive_path(content_hash, root=None):
+    return os.path.join(root or ARCHIVE_DIR, "objects", content_hash[:2], content_hash + ".html.gz")
+
+def archive_page(form, direction_id, resp, content_hash):
+    # Страница сохраняется сжатой под своим хешем, одинаковые страницы — один
+    # файл; в index.jsonl дописывается, что и когда было получено
+    if not ARCHIVE_DIR:
+        return
+    path = archive_path(content_hash)
+    entry = {"form": form, "direction_id": direction_id,
+             "fetched_at": datetime.now().isoformat(sep=" ", timespec="seconds"),
+             "sha256": content_hash, "bytes": len(resp.content),
+             "encoding": resp.encoding or resp.apparent_encoding,
+             "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+    try:
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(resp.content)
+            os.replace(tmp, path)
+        with _archive_lock, open(os.path.join(ARCHIVE_DIR, "index.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+def load_archive_index(until=None, root=None):
+    # Записи архива по времени получения; until — строка "ГГГГ-ММ-ДД ЧЧ:ММ:СС", не включая
+    entries = []
+    try:
+        with open(os.path.join(root or ARCHIVE_DIR, "index.jsonl"), encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if until is None or entry["fetched_at"] < until:
+            entries.append(entry)
+    entries.sort(key=lambda e: e["fetched_at"])
+    return entries
+
+def archived_pages(until=None, root=None):
+    # Последняя полученная страница каждого направления на момент until
+    return {(e["form"], e["direction_id"]): e for e in load_archive_index(until, root)}
+
+def read_archived_page(content_hash, encoding=None, root=None):
+    with gzip.open(archive_path(content_hash, root), "rb") as f:
+        return f.read().decode(encoding or "utf-8", errors="replace")
+
+def _parse_archived(root, content_hash, encoding, backend):
+    # Ошибка возвращается текстом, чтобы одна битая страница не обрывала остальные
+    try:
+        return parse_page(read_archived_page(content_hash, encoding, root), backend), None
+    except Exception as e:
+        return None, describe_error(e)
+
+def rebuild_from_archive(until=None, workers=None, full=False):
+    # Списки в базе заново собираются из архива без обращения к сайту:
+    # каждая различная страница разбирается один раз в пуле процессов, затем
+    # обе формы публикуются как при обычном обновлении. Страницы с тем же
+    # хэшем, что уже в базе, пропускаются (full — разобрать все, например
+    # после изменения разбора). История версий дополняется, а не
+    # восстанавливается; чистка версий остаётся обычному обновлению.
+    pages = archived_pages(until)
+    conn = get_connection()
+    try:
+        stored = {} if full else {form_name(contract): load_fingerprints(conn, contract) for contract in (False, True)}
+        changed = {key: e for key, e in pages.items()
+                   if (stored.get(key[0], {}).get(key[1]) or (None, None))[1] != e["sha256"]}
+        unique = {e["sha256"]: e.get("encoding") for e in changed.values()}
+        hashes = list(unique)
+        args = ([ARCHIVE_DIR] * len(hashes), hashes, [unique[h] for h in hashes], [PARSER_BACKEND] * len(hashes))
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(hashes) <= 1:
+            outcomes = list(map(_parse_archived, *args))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                outcomes = list(pool.map(_parse_archived, *args, chunksize=max(1, len(hashes) // (workers * 4))))
+        parsed = {h: result for h, (result, _) in zip(hashes, outcomes) if result is not None}
+        errors = {h: error for h, (_, error) in zip(hashes, outcomes) if error is not None}
+        failed = []
+        published = 0
+        for contract in (False, True):
+            form = form_name(contract)
+            staged = {}
+            for (entry_form, did), e in sorted(changed.items()):
+                if entry_form != form:
+                    continue
+                if e["sha256"] not in parsed:
+                    failed.append((form, did, errors.get(e["sha256"])))
+                    continue
+                places, name, update_time, rows = parsed[e["sha256"]]
+                staged[did] = (places, name, update_time, rows,
+                               (update_time, e["sha256"], e.get("etag"), e.get("last_modified")))
+            if staged:
+                results = publish_staged(conn, contract, staged, incremental=True)
+                published += sum(1 for r in results.values() if r)
+    finally:
+        conn.close()
+    ensure_contract_summary()
+    return {"pages": len(pages), "unchanged": len(pages) - len(changed), "unique": len(unique),
+            "published": published, "failed": failed}
+
+@contextmanager
+def use_database(path):
+    # Временная подмена базы вместе с кэшами хранилища и симуляции
+    global DB_PATH, _store, _admission_state
+    saved = DB_PATH, _store, _admission_state
+    DB_PATH, _store, _admission_state = path, None, None
+    try:
+        yield
+    finally:
+        DB_PATH, _store, _admission_state = saved
+
+def replay_day(day, workers=None):
+    # Симуляция по страницам, которые были на сайте к концу дня day
+    # ("ГГГГ-ММ-ДД"): база собирается из архива во временном файле
+    until = (datetime.fromisoformat(str(day)) + timedelta(days=1)).isoformat(sep=" ", timespec="seconds")
+    live = DB_PATH
+    with tempfile.TemporaryDirectory() as tmp, use_database(os.path.join(tmp, "replay.db")):
+        if os.path.exists(live):
+            # Каталог направлений берётся из рабочей базы
+            conn = get_connection()
+            conn.execute("ATTACH DATABASE ? AS live", (live,))
+            conn.execute("INSERT INTO catalog SELECT * FROM live.catalog")
+            conn.commit()
+            conn.execute("DETACH DATABASE live")
+            conn.close()
+        rebuilt = rebuild_from_archive(until, workers)
+        budget_places, budget_names, budget_times = load_directions(False)
+        contract_places, contract_names, contract_times = load_directions(True)
+        admitted, cutoffs = simulate_admission(budget_places)
+        contract_admitted = simulate_contract(admitted, contract_places)
+    return {
+        "until": until,
+        "rebuilt": rebuilt,
+        "budget": {"places": budget_places, "names": budget_names, "times": budget_times,
+                   "admitted": admitted, "cutoffs": cutoffs},
+        "contract": {"places": contract_places, "names": contract_names, "times": contract_times,
+                     "admitted": contract_admitted},
+    }
+
+STORE_TYPES = {"reg": "i", "did": "i", "priority": "h", "score": "i", "ind": "h", "position": "i", "flags": "B"}
+FLAG_ORIGINALS, FLAG_SIGNED, FLAG_APPLIED = 1, 2, 4
+
+_store = None
+_store_lock = threading.RLock()  # get_store может войти повторно через перенос старой базы
+
+def empty_columns():
+    return {key: array(code) for key, code in STORE_TYPES.items()}
+
+def place_flags(has_originals, place_type):
+    ptype = (place_type or "").lower()
+    return ((FLAG_ORIGINALS if has_originals else 0)
+            | (FLAG_SIGNED if "заключен договор" in ptype else 0)
+            | (FLAG_APPLIED if "подано заявление" in ptype else 0))
+
+def intern_reg(store, reg):
+    # Номер -> целый ID. Нормализованные номера почти всегда уникальны,
+    # совпадения разных написаний хранятся отдельно в norm_dups
+    rid = store["reg_ids"].get(reg)
+    if rid is None:
+        rid = store["reg_ids"][reg] = len(store["regs"])
+        store["regs"].append(reg)
+        norm = normalize_reg(reg)
+        if norm in store["norm_ids"]:
+            store["norm_dups"].setdefault(norm, [store["norm_ids"][norm]]).append(rid)
+        else:
+            store["norm_ids"][norm] = rid
+        store["sorted_norms"] = None
+    return rid
+
+def norm_reg_ids(store, norm):
+    if norm in store["norm_dups"]:
+        return store["norm_dups"][norm]
+    return [store["norm_ids"][norm]] if norm in store["norm_ids"] else []
+
+def load_segment(store, cur, form, direction_id, cols):
+    # Дописывает заявления направления в столбцы в порядке рейтинга
+    cur.execute("""
+        SELECT reg_number, priority, total_score, individual_achievements, position, has_originals, place_type
+        FROM applicants WHERE form = ? AND direction_id = ? ORDER BY position
+    """, (form, direction_id))
+    for reg, pr, score, ind, pos, orig, ptype in cur.fetchall():
+        cols["reg"].append(intern_reg(store, reg))
+        cols["did"].append(direction_id)
+        cols["priority"].append(pr or 0)
+        cols["score"].append(score or 0)
+        cols["ind"].append(ind or 0)
+        cols["position"].append(pos or 0)
+        cols["flags"].append(place_flags(orig, ptype))
+
+def build_view(store, cur, form, dids, changed, old=None):
+    # Столбцы формы обучения по направлениям. Неизменившиеся направления
+    # копируются срезами из прошлой версии, остальные читаются из базы.
+    cols = empty_columns()
+    offsets = {}
+    for did in sorted(dids):
+        start = len(cols["reg"])
+        if old and did in old["offsets"] and (form, did) not in changed:
+            s, e = old["offsets"][did]
+            for key, col in cols.items():
+                col.extend(old["columns"][key][s:e])
+        else:
+            load_segment(store, cur, form, did, cols)
+        offsets[did] = (start, len(cols["reg"]))
+    # Индекс заявлений по абитуриентам: номера строк, упорядоченные по ID
+    reg_start = array("i", [0]) * (len(store["regs"]) + 1)
+    for rid in cols["reg"]:
+        reg_start[rid + 1] += 1
+    for rid in range(len(store["regs"])):
+        reg_start[rid + 1] += reg_start[rid]
+    reg_index = array("i", [0]) * len(cols["reg"])
+    fill = array("i", reg_start)
+    for i, rid in enumerate(cols["reg"]):
+        reg_index[fill[rid]] = i
+        fill[rid] += 1
+    return {"columns": cols, "offsets": offsets,
+            "reg_start": reg_start, "reg_index": reg_index}
+
+def reg_rows(view, rid):
+    start = view["reg_start"]
+    if rid + 1 >= len(start):
+        return ()
+    return view["reg_index"][start[rid]:start[rid + 1]]
+
+def get_store():
+    # Общее хранилище заявлений в памяти, одно на версию данных. После
+    # обновления перечитываются только направления с новой подписью (хеш
+    # страницы, время обновления, число строк и последняя версия в истории —
+    # store_direction пишет её при каждой записи, даже если страница та же).
+    # Новая версия собирается в новом словаре: прежнюю могут читать другие сессии.
+    global _store
+    with _store_lock:
+        conn = get_connection()
+        version = data_version(conn)
+        if _store is not None and _store["version"] == version:
+            conn.close()
+            return _store
+        base = _store or {"regs": [], "reg_ids": {}, "norm_ids": {}, "norm_dups": {}, "sorted_norms": None,
+                          "signatures": {}, "views": {}}
+        store = {"regs": list(base["regs"]), "reg_ids": dict(base["reg_ids"]), "norm_ids": dict(base["norm_ids"]),
+                 "norm_dups": {norm: list(ids) for norm, ids in base["norm_dups"].items()},
+                 "sorted_norms": base["sorted_norms"]}
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT d.form, d.direction_id, d.name, f.content_hash, d.update_time, c.n, s.last
+            FROM directions d
+            LEFT JOIN fingerprints f USING (form, direction_id)
+            LEFT JOIN (SELECT form, direction_id, COUNT(*) AS n FROM applicants GROUP BY form, direction_id) c
+                USING (form, direction_id)
+            LEFT JOIN (SELECT form, direction_id, MAX(snapshot_id) AS last FROM snapshots GROUP BY form, direction_id) s
+                USING (form, direction_id)
+        """)
+        signatures, names = {}, {}
+        for form, did, name, content_hash, update_time, n, last in cur.fetchall():
+            signatures[form, did] = (content_hash, update_time, n or 0, last)
+            names[form, did] = name
+        changed = {key for key in signatures.keys() | base["signatures"].keys()
+                   if base["signatures"].get(key) != signatures.get(key)}
+        views = dict(base["views"])
+        for form in ("budget", "contract"):
+            if form not in views or any(f == form for f, _ in changed):
+                views[form] = build_view(store, cur, form, [did for f, did in signatures if f == form],
+                                         changed, views.get(form))
+        cur.close()
+        conn.close()
+        store.update(version=version, signatures=signatures, names=names, views=views)
+        _store = store
+        return store
+
+_admission_state = None
+
+def _index_choices(apps, indices, places, originals_only):
+    # Заявления абитуриента, участвующие в конкурсе, в порядке приоритета
+    did, flags, priority = apps["did"], apps["flags"], apps["priority"]
+    eligible = [i for i in indices
+                if places.get(did[i], 0) > 0 and (flags[i] & FLAG_ORIGINALS or not originals_only)]
+    return sorted(eligible, key=priority.__getitem__)
+
+def _run_deferred_acceptance(apps, choices, places, heaps=None, start=0, extra=()):
+    # Отложенное принятие (Гейл–Шепли) с приоритетами абитуриентов: каждый идёт
+    # по своим заявлениям от приоритета 1, направление держит кучу лучших
+    # размером в число мест и выталкивает худшего, который идёт к следующему
+    # приоритету. Порядок на направлении — баллы, затем ИД, затем позиция в
+    # рейтинге. В элементе кучи хранится номер заявления и индекс следующего.
+    # heaps и start продолжают уже начатый прогон, extra — строки в порядке
+    # STORE_TYPES под номерами после конца столбцов.
+    did_col, score, ind, position = apps["did"], apps["score"], apps["ind"], apps["position"]
+    n = len(did_col)
+    if heaps is None:
+        heaps = {did: [] for did, cap in places.items() if cap > 0}
+    queue = list(choices.values())
+    resume = [start] * len(queue)
+    while queue:
+        lst = queue.pop()
+        k = resume.pop()
+        while k < len(lst):
+            i = lst[k]
+            k += 1
+            if i < n:
+                did, entry = did_col[i], (score[i], ind[i], -position[i], -i, k, lst)
+            else:
+                _, did, _, sc, ai, pos, _ = extra[i - n]
+                entry = (sc, ai, -pos, -i, k, lst)
+            heap = heaps[did]
+            if len(heap) < places[did]:
+                heapq.heappush(heap, entry)
+                break
+            if entry > heap[0]:
+                worst = heapq.heapreplace(heap, entry)
+                queue.append(worst[5])
+                resume.append(worst[4])
+                break
+    return heaps
+
+def columns_from_tuples(applications):
+    # (reg, did, priority, score, ind, position, has_originals) -> столбцы и словарь номеров
+    cols = empty_columns()
+    regs, reg_ids = [], {}
+    for reg, did, pr, score, ind, pos, orig in applications:
+        if reg not in reg_ids:
+            reg_ids[reg] = len(regs)
+            regs.append(reg)
+        cols["reg"].append(reg_ids[reg])
+        cols["did"].append(did)
+        cols["priority"].append(pr)
+        cols["score"].append(score)
+        cols["ind"].append(ind)
+        cols["position"].append(pos)
+        cols["flags"].append(FLAG_ORIGINALS if orig else 0)
+    return cols, regs, reg_ids
+
+def build_admission_state(apps, places, originals_only=False, regs=None, reg_ids=None):
+    # apps — столбцы заявлений (см. STORE_TYPES) либо список кортежей
+    # (reg, did, priority, score, ind, position, has_originals). Состояние
+    # хранится для последующих what-if запросов.
+    if not isinstance(apps, dict):
+        apps, regs, reg_ids = columns_from_tuples(apps)
+    by_reg = {}
+    for i, rid in enumerate(apps["reg"]):
+        by_reg.setdefault(rid, []).append(i)
+    choices = {}
+    for rid, indices in by_reg.items():
+        lst = _index_choices(apps, indices, places, originals_only)
+        if lst:
+            choices[rid] = lst
+    heaps = _run_deferred_acceptance(apps, choices, places)
+    return {
+        "applications": apps,
+        "regs": regs,
+        "reg_ids": reg_ids,
+        "places": dict(places),
+        "originals_only": originals_only,
+        "by_reg": by_reg,
+        "choices": choices,
+        "heaps": heaps,
+        "seated": {-e[3] for heap in heaps.values() for e in heap},
+    }
+
+def admission_outcome(state, reg):
+    apps = state["applications"]
+    for i in state["by_reg"].get(state["reg_ids"].get(reg), []):
+        if i in state["seated"]:
+            return apps["did"][i], apps["priority"][i], apps["score"][i]
+    return None
+
+def admission_results(state):
+    apps, regs = state["applications"], state["regs"]
+    admitted, cutoffs = {}, {}
+    for did, cap in state["places"].items():
+        heap = sorted(state["heaps"].get(did, []), key=lambda e: e[:4], reverse=True)
+        admitted[did] = [(regs[apps["reg"][-e[3]]], e[0], apps["priority"][-e[3]]) for e in heap]
+        cutoffs[did] = heap[-1][0] if cap > 0 and len(heap) >= cap else None
+    return admitted, cutoffs
+
+def deferred_acceptance(applications, places, originals_only=False):
+    return admission_results(build_admission_state(applications, places, originals_only))
+
+def what_if(reg, priorities=None, score=None, originals=None, add=None, withdraw=None,
+            state=None, commit=False):
+    # Изменения одного абитуриента: priorities — {did: новый приоритет},
+    # add — [(did, приоритет)], withdraw — список did или True для всех заявлений.
+    # Столбцы не копируются: изменённые строки абитуриента получают номера
+    # после конца столбцов. Если поданные им в прогоне заявления (до места
+    # включительно) не изменились, итог прежний, а если он не прошёл и список
+    # только удлинился, прогон продолжается с его новых заявлений. Иначе уход
+    # абитуриента может открыть циклы улучшений, и очередь прогоняется целиком.
+    state = state or _admission_state
+    if state is None:
+        raise RuntimeError("Сначала выполните симуляцию поступления на бюджет")
+    apps, places, seated = state["applications"], state["places"], state["seated"]
+    n = len(apps["reg"])
+    before = admission_outcome(state, reg)
+    regs, reg_ids = state["regs"], state["reg_ids"]
+    if reg not in reg_ids:
+        regs, reg_ids = regs + [reg], dict(reg_ids, **{reg: len(regs)})
+    rid = reg_ids[reg]
+    indices = state["by_reg"].get(rid, [])
+    rows = []
+    for i in indices:
+        row = [apps[key][i] for key in STORE_TYPES]
+        if withdraw is True or (withdraw and row[1] in withdraw):
+            continue
+        if priorities and row[1] in priorities:
+            row[2] = priorities[row[1]]
+        if score is not None:
+            row[3] = score
+        if originals is not None:
+            row[6] = row[6] | FLAG_ORIGINALS if originals else row[6] & ~FLAG_ORIGINALS
+        rows.append(row)
+    if indices:
+        sc, ind, flags = (apps[key][indices[0]] for key in ("score", "ind", "flags"))
+        sc = sc if score is None else score
+        flags = flags if originals is None else (flags | FLAG_ORIGINALS if originals else flags & ~FLAG_ORIGINALS)
+    else:
+        sc, ind, flags = score or 0, 0, FLAG_ORIGINALS if originals else 0
+    for did, pr in add or []:
+        rows.append([rid, did, pr, sc, ind, 10 ** 9, flags])
+    lst = sorted((n + j for j, row in enumerate(rows)
+                  if places.get(row[1], 0) > 0 and (row[6] & FLAG_ORIGINALS or not state["originals_only"])),
+                 key=lambda i: rows[i - n][2])
+    choices = dict(state["choices"])
+    if lst:
+        choices[rid] = lst
+    else:
+        choices.pop(rid, None)
+    old = state["choices"].get(rid, [])
+    seat = next((k for k, i in enumerate(old) if i in seated), None)
+    made = old if seat is None else old[:seat + 1]
+    key = lambda i: (apps["did"][i], apps["score"][i], apps["ind"][i], apps["position"][i])
+    if len(lst) >= len(made) and all(key(i) == (row[1], row[3], row[4], row[5])
+                                     for i, row in zip(made, (rows[i - n] for i in lst))):
+        heaps = {did: list(heap) for did, heap in state["heaps"].items()}
+        if seat is None:
+            _run_deferred_acceptance(apps, {rid: lst}, places, heaps, len(made), rows)
+        else:
+            heap = heaps[apps["did"][made[-1]]]
+            k = next(k for k, e in enumerate(heap) if -e[3] == made[-1])
+            heap[k] = heap[k][:3] + (-lst[seat], heap[k][4], lst)
+    else:
+        heaps = _run_deferred_acceptance(apps, choices, places, extra=rows)
+    reg_of = lambda i: apps["reg"][i] if i < n else rid
+    changed = {}
+    for did, heap in heaps.items():
+        if heap == state["heaps"][did]:
+            continue
+        old_set = {regs[apps["reg"][-e[3]]] for e in state["heaps"][did]}
+        new_set = {regs[reg_of(-e[3])] for e in heap}
+        if old_set != new_set:
+            changed[did] = {"added": sorted(new_set - old_set), "removed": sorted(old_set - new_set)}
+    new_seated = {-e[3] for heap in heaps.values() for e in heap}
+    after = next(((rows[i - n][1], rows[i - n][2], rows[i - n][3]) for i in lst if i in new_seated), None)
+    if commit:
+        columns = {key: array(col.typecode, col) for key, col in apps.items()}
+        for row in rows:
+            for key, value in zip(STORE_TYPES, row):
+                columns[key].append(value)
+        by_reg = dict(state["by_reg"])
+        by_reg[rid] = list(range(n, n + len(rows)))
+        state.update(applications=columns, regs=regs, reg_ids=reg_ids, by_reg=by_reg, choices=choices,
+                     heaps=heaps, seated=new_seated)
+    return {"before": before, "after": after, "changed": changed}
+
+def admission_state(budget_places, originals_only=False):
+    state = _admission_state
+    if (state is None or state["places"] != budget_places or state["originals_only"] != originals_only
+            or state["version"] != data_version()):
+        simulate_admission(budget_places, originals_only)
+    return _admission_state
+
+def simulate_admission(budget_places, originals_only=False):
+    global _admission_state
+    store = get_store()
+    state = build_admission_state(store["views"]["budget"]["columns"], budget_places, originals_only,
+                                  store["regs"], store["reg_ids"])
+    state["version"] = store["version"]
+    _admission_state = state
+    return admission_results(state)
+
+def group_bounds(keys):
+    # Начала групп одинаковых подряд ключей и номер группы каждого элемента
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return np.flatnonzero(first), np.cumsum(first) - 1
+
+def contract_fill(store, banned, places):
+    # Заполнение мест на контракт сразу по всем направлениям: строки, которые
+    # участвуют (договор или заявление, абитуриент не прошёл на бюджет),
+    # сортируются по направлению, затем договоры в порядке рейтинга, затем
+    # заявления по приоритету и баллам; место в этом порядке сравнивается с
+    # числом мест, договоры проходят всегда.
+    cols = store["views"]["contract"]["columns"]
+    reg, did, priority, score, flags = (np.asarray(cols[key]) for key in ("reg", "did", "priority", "score", "flags"))
+    out = np.zeros(len(store["regs"]), dtype=bool)
+    out[list(banned)] = True
+    out = out[reg]
+    signed = (flags & FLAG_SIGNED).astype(bool) & ~out
+    applied = (flags & FLAG_APPLIED).astype(bool) & ~signed & ~out
+    rows = np.flatnonzero(signed | applied)
+    later = applied[rows].astype(np.int8)
+    order = rows[np.lexsort((rows, -score[rows] * later, priority[rows] * later, later, did[rows]))]
+    dids = did[order]
+    starts, group = group_bounds(dids)
+    rank = np.arange(len(order)) - starts[group]
+    capacity = np.array([places.get(int(d), 0) for d in dids[starts]], dtype=np.int64)
+    admitted = signed[order] | (rank < capacity[group])
+    return {"order": order, "did": dids, "rank": rank, "admitted": admitted, "signed": signed[order],
+            "starts": starts, "group": group, "score": score, "reg": reg, "priority": priority}
+
+def default_budget_banned(store):
+    # Кто проходит на бюджет при числе мест с сайта и без учёта оригиналов
+    budget_places, _, _ = load_directions(False)
+    state = build_admission_state(store["views"]["budget"]["columns"], budget_places, False,
+                                  store["regs"], store["reg_ids"])
+    return {state["applications"]["reg"][i] for i in state["seated"]}
+
+def simulate_contract(budget_admitted=None, contract_places=None):
+    # Без budget_admitted на бюджет зачисляются по числу мест с сайта
+    store = get_store()
+    regs, reg_ids = store["regs"], store["reg_ids"]
+    if budget_admitted is None:
+        banned = default_budget_banned(store)
+    else:
+        banned = {reg_ids[reg] for lst in budget_admitted.values() for reg, *_ in lst if reg in reg_ids}
+    if contract_places is None:
+        contract_places, _, _ = load_directions(True)
+    fill = contract_fill(store, banned, contract_places)
+    admitted = {did: [] for did in direction_ids(True)}
+    order, dids = fill["order"][fill["admitted"]], fill["did"][fill["admitted"]]
+    reg, score, priority = fill["reg"][order].tolist(), fill["score"][order].tolist(), fill["priority"][order].tolist()
+    for k, did in enumerate(dids.tolist()):
+        if did in admitted:
+            admitted[did].append((regs[reg[k]], score[k], priority[k]))
     return admitted
 
+NO_CUTOFF = np.iinfo(np.int32).max
+
+def refresh_contract_summary():
+    # Материализованная сводка по контракту для текущей версии данных: по
+    # направлению — мест, договоров, зачислено, свободно и проходной балл
+    # (только при заполненных местах, по прошедшим заявлениям без договора),
+    # по заявлению — место в порядке заполнения, проходит ли и запас баллов
+    # до проходного (только у участвующих в заполнении).
+    store = get_store()
+    contract_places, _, _ = load_directions(True)
+    fill = contract_fill(store, default_budget_banned(store), contract_places)
+    order, starts = fill["order"], fill["starts"]
+    stats = {}
+    if len(order):
+        competing = fill["admitted"] & ~fill["signed"]
+        lowest = np.where(competing, fill["score"][order], NO_CUTOFF)
+        stats = dict(zip(fill["did"][starts].tolist(), zip(
+            np.add.reduceat(fill["signed"].astype(np.int64), starts).tolist(),
+            np.add.reduceat(fill["admitted"].astype(np.int64), starts).tolist(),
+            np.minimum.reduceat(lowest, starts).tolist())))
+    cols = store["views"]["contract"]["columns"]
+    did_col = np.asarray(cols["did"])
+    cutoffs = np.full(int(did_col.max()) + 1 if len(did_col) else 0, -1, dtype=np.int64)
+    summary = []
+    for did, places in sorted(contract_places.items()):
+        signed, admitted, lowest = stats.get(did, (0, 0, None))
+        cutoff = lowest if places > 0 and admitted >= places and lowest != NO_CUTOFF else None
+        if cutoff is not None and did < len(cutoffs):
+            cutoffs[did] = cutoff
+        summary.append((did, places, signed, admitted, max(places - admitted, 0), cutoff))
+    rank = np.full(len(did_col), -1, dtype=np.int64)
+    rank[order] = fill["rank"]
+    passed = np.zeros(len(did_col), dtype=bool)
+    passed[order] = fill["admitted"]
+    row_cutoff = cutoffs[did_col]
+    row_cutoff[rank < 0] = -1  # прошедшие на бюджет и строки без договора и заявления не участвуют
+    margin = np.where(row_cutoff >= 0, fill["score"] - row_cutoff, -1)
+    regs = store["regs"]
+    margins = [(did, regs[rid], rk + 1 if rk >= 0 else None, ok, m if c >= 0 else None)
+               for did, rid, rk, ok, m, c in zip(did_col.tolist(), fill["reg"].tolist(), rank.tolist(),
+                                                 passed.tolist(), margin.tolist(), row_cutoff.tolist())]
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM contract_summary")
+        conn.execute("DELETE FROM contract_margins")
+        conn.executemany("INSERT INTO contract_summary (direction_id, places, signed, admitted, free_places, cutoff) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", summary)
+        conn.executemany("INSERT INTO contract_margins (direction_id, reg_number, fill_rank, admitted, margin) "
+                         "VALUES (?, ?, ?, ?, ?)", margins)
+        conn.execute("REPLACE INTO metadata (key, value) VALUES ('contract_summary_version', ?)",
+                     (str(store["version"]),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def contract_summary_version(conn=None):
+    # Версия данных, по которой посчитана сводка по контракту; None — ещё не считалась
+    own = conn is None
+    conn = conn or get_connection()
+    row = conn.execute("SELECT value FROM metadata WHERE key = 'contract_summary_version'").fetchone()
+    if own:
+        conn.close()
+    return int(row[0]) if row else None
+
+def ensure_contract_summary():
+    # Пересчёт сводки вызывают все, кто меняет данные; читатели её только читают
+    conn = get_connection()
+    fresh = contract_summary_version(conn) == data_version(conn)
+    conn.close()
+    if not fresh:
+        refresh_contract_summary()
+
+def load_contract_summary():
+    # Сводка как есть, даже устаревшая: свежесть проверяет contract_summary_version
+    conn = get_connection()
+    cur = conn.execute("SELECT direction_id, places, signed, admitted, free_places, cutoff FROM contract_summary "
+                       "ORDER BY direction_id")
+    result = [{"direction_id": did, "places": places, "signed": signed, "admitted": admitted,
+               "free_places": free, "cutoff": cutoff} for did, places, signed, admitted, free, cutoff in cur.fetchall()]
+    conn.close()
+    return result
+
+def load_contract_margins(reg_numbers):
+    # {(направление, номер): (проходит, запас баллов)} из материализованной сводки;
+    # пока сводка не пересчитана после записи, запаса нет
+    if not reg_numbers:
+        return {}
+    conn = get_connection()
+    result = {}
+    if contract_summary_version(conn) == data_version(conn):
+        cur = conn.execute("SELECT direction_id, reg_number, admitted, margin FROM contract_margins "
+                           "WHERE reg_number IN (SELECT value FROM json_each(?))", (json.dumps(list(reg_numbers)),))
+        result = {(did, reg): (bool(admitted), margin) for did, reg, admitted, margin in cur.fetchall()}
+    conn.close()
+    return result
+
+_mc_dataset = None
+
+def load_simulation_dataset(budget_places, contract_places):
+    # Всё для прогонов Монте-Карло массивами numpy: заявления на бюджет
+    # по направлениям в порядке рейтинга («места» в этом порядке), списки
+    # заявлений абитуриентов по приоритету номерами мест, строки контракта
+    # в порядке заполнения. Абитуриенты пронумерованы заново от нуля.
+    store = get_store()
+    apps = store["views"]["budget"]["columns"]
+    state = build_admission_state(apps, budget_places, False, store["regs"], store["reg_ids"])
+    choices = state["choices"]
+    fill = contract_fill(store, (), contract_places)
+    contract_rid = fill["reg"][fill["order"]]
+    rids = np.unique(np.concatenate([np.fromiter(choices, dtype=np.int64, count=len(choices)),
+                                     contract_rid.astype(np.int64)]))
+    local = dict(zip(rids.tolist(), range(len(rids))))
+    reg, did, score, ind, position = (np.asarray(apps[key], dtype=np.int64)
+                                      for key in ("reg", "did", "score", "ind", "position"))
+    chosen = np.unique(np.fromiter((i for lst in choices.values() for i in lst), dtype=np.int64))
+    order = chosen[np.lexsort((chosen, position[chosen], -ind[chosen], -score[chosen], did[chosen]))]
+    slot = np.full(len(reg), -1, dtype=np.int64)
+    slot[order] = np.arange(len(order))
+    starts, group = group_bounds(did[order])
+    budget_dids = did[order][starts]
+    width = max((len(lst) for lst in choices.values()), default=0) + 1
+    lists = np.full((len(choices), width), -1, dtype=np.int64)  # последний столбец — заявления кончились
+    for k, lst in enumerate(choices.values()):
+        lists[k, :len(lst)] = slot[lst]
+    flags = np.asarray(apps["flags"])
+    originals = np.zeros(len(rids), dtype=bool)
+    originals[[local[rid] for rid in np.unique(reg[(flags & FLAG_ORIGINALS) > 0]).tolist() if rid in local]] = True
+    contract_dids = fill["did"][fill["starts"]]
+    return {
+        "regs": rids,
+        "originals": originals,
+        "budget": {
+            "lists": lists,
+            "chooser": np.array([local[rid] for rid in choices], dtype=np.int64),
+            "local": np.array([local[rid] for rid in reg[order].tolist()], dtype=np.int64),
+            "reg": reg[order], "did": did[order], "score": score[order],
+            "starts": starts, "group": group, "dids": budget_dids,
+            "capacity": np.array([budget_places[d] for d in budget_dids.tolist()], dtype=np.int64),
+            "empty": sorted(set(d for d, cap in budget_places.items() if cap > 0) - set(budget_dids.tolist())),
+        },
+        "contract": {
+            "local": np.array([local[rid] for rid in contract_rid.tolist()], dtype=np.int64),
+            "reg": contract_rid, "did": fill["did"], "signed": fill["signed"],
+            "score": fill["score"][fill["order"]].astype(np.int64),
+            "starts": fill["starts"], "group": fill["group"], "dids": contract_dids,
+            "capacity": np.array([contract_places.get(d, 0) for d in contract_dids.tolist()], dtype=np.int64),
+            "empty": sorted(set(store["views"]["contract"]["offsets"]) - set(contract_dids.tolist())),
+        },
+    }
+
+def _mc_init(dataset):
+    global _mc_dataset
+    _mc_dataset = dataset
+
+def _count_in_groups(taken, starts):
+    # Для каждого прогона и места — сколько отмечено до него включительно и
+    # сколько отмечено до начала каждой группы
+    count = np.cumsum(taken, axis=1, dtype=np.int32)
+    before = np.concatenate([np.zeros((len(taken), 1), dtype=np.int32), count], axis=1)[:, starts]
+    return count, before
+
+def _count_outcomes(admitted, cutoffs, form, part, passed, competing):
+    # Сколько раз прошла каждая строка и распределение проходного балла:
+    # наименьший балл среди competing, если места направления заполнены
+    # (None — недобор). Прогоны, где места заняты одними договорами,
+    # проходного балла не дают.
+    for k in np.flatnonzero(passed.any(axis=0)).tolist():
+        admitted[form, int(part["did"][k]), int(part["reg"][k])] += int(passed[:, k].sum())
+    if len(part["starts"]):
+        total = np.add.reduceat(passed, part["starts"], axis=1)
+        lowest = np.minimum.reduceat(np.where(competing, part["score"], NO_CUTOFF), part["starts"], axis=1)
+        lowest[~((part["capacity"] > 0) & (total >= part["capacity"]))] = -1
+        for did, column in zip(part["dids"].tolist(), lowest.T):
+            for value, count in zip(*np.unique(column, return_counts=True)):
+                if value != NO_CUTOFF:
+                    cutoffs[form, did, None if value < 0 else int(value)] += int(count)
+    for did in part["empty"]:
+        cutoffs[form, did, None] += len(passed)
+
+def _mc_batch(data, runs, seed, p_originals, p_withdraw, p_contract, admitted, cutoffs):
+    # Прогоны пачки считаются одновременно массивами (прогон × абитуриент)
+    n_regs = len(data["regs"])
+    budget, contract = data["budget"], data["contract"]
+    draws = np.stack([np.random.default_rng([seed, run]).random(2 * n_regs + len(contract["reg"])) for run in runs])
+    active = draws[:, :n_regs] >= p_withdraw
+    submitted = active & (data["originals"] | (draws[:, n_regs:2 * n_regs] < p_originals))
+    # Бюджет: отложенное принятие, где все отвергнутые одновременно идут к
+    # следующему приоритету, а направление держит первых по рейтингу в числе
+    # мест — результат тот же, что у очереди в _run_deferred_acceptance
+    lists, chooser, group, starts = budget["lists"], budget["chooser"], budget["group"], budget["starts"]
+    n, width = len(group), lists.shape[1]
+    first = np.arange(len(chooser)) * width
+    seated = np.zeros((len(runs), n), dtype=bool)
+    pending = np.arange(len(runs))  # прогоны, где ещё есть отказы
+    step = np.zeros((len(runs), len(chooser)), dtype=np.intp)
+    proposing = submitted[:, chooser]
+    while len(pending):
+        cells = np.arange(len(pending))[:, None] * (n + 1)  # начала строк в плоском (прогон × место)
+        slot = lists.ravel()[first + step]
+        live = proposing & (slot >= 0)
+        flat = cells + np.where(live, slot, n)
+        taken = np.zeros((len(pending), n + 1), dtype=bool)
+        taken.ravel()[flat] = True
+        count, before = _count_in_groups(taken, starts)
+        limit = before + budget["capacity"]
+        rejected = live & (count.ravel()[flat] > limit.ravel()[np.arange(len(pending))[:, None] * len(starts)
+                                                              + group[slot]])
+        done = ~rejected.any(axis=1)
+        seated[pending[done]] = taken[done, :n]
+        pending, step, proposing = pending[~done], step[~done] + rejected[~done], proposing[~done]
+    _count_outcomes(admitted, cutoffs, "budget", budget, seated, seated)
+    # Контракт: прошедшие на бюджет и отозвавшие не участвуют, заявление
+    # становится договором с вероятностью p_contract; места по порядку заполнения
+    banned = np.zeros((len(runs), n_regs), dtype=bool)
+    r, k = np.nonzero(seated)
+    banned[r, budget["local"][k]] = True
+    local, signed, group = contract["local"], contract["signed"], contract["group"]
+    keep = active[:, local] & ~banned[:, local] & (signed | (draws[:, 2 * n_regs:] < p_contract))
+    count, before = _count_in_groups(keep, contract["starts"])
+    passed = keep & (signed | (count - before[:, group] <= contract["capacity"][group]))
+    _count_outcomes(admitted, cutoffs, "contract", contract, passed, passed & ~signed)
+
+def _mc_runs(run_ids, seed, p_originals, p_withdraw, p_contract):
+    data = _mc_dataset
+    admitted, cutoffs = Counter(), Counter()
+    run_ids = list(run_ids)
+    for start in range(0, len(run_ids), MC_BATCH):
+        _mc_batch(data, run_ids[start:start + MC_BATCH], seed, p_originals, p_withdraw, p_contract,
+                  admitted, cutoffs)
+    return admitted, cutoffs
+
+def simulate_probabilities(budget_places, contract_places, runs=1000, seed=0, p_originals=0.5,
+                           p_withdraw=0.1, p_contract=0.5, workers=None):
+    # Монте-Карло: в каждом прогоне абитуриент с вероятностью p_withdraw
+    # отзывает заявления, без оригиналов подаёт их с вероятностью p_originals,
+    # «подано заявление» на контракт превращается в договор с вероятностью
+    # p_contract. Случайный поток каждого прогона зависит только от seed и
+    # номера прогона, поэтому результат не зависит от числа процессов.
+    dataset = load_simulation_dataset(budget_places, contract_places)
+    regs = get_store()["regs"]
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, -(-runs // (workers * 4)))
+    batches = [range(start, min(start + chunk, runs)) for start in range(0, runs, chunk)]
+    admitted, cutoffs = Counter(), Counter()
+    args = (seed, p_originals, p_withdraw, p_contract)
+    if workers == 1:
+        _mc_init(dataset)
+        parts = [_mc_runs(batch, *args) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_mc_init, initargs=(dataset,)) as pool:
+            parts = list(pool.map(_mc_runs, batches, *[[a] * len(batches) for a in args]))
+    for adm, cut in parts:
+        admitted.update(adm)
+        cutoffs.update(cut)
+    probabilities = {(form, did, regs[rid]): count / runs for (form, did, rid), count in admitted.items()}
+    distributions = {}
+    for (form, did, score), count in cutoffs.items():
+        distributions.setdefault((form, did), {})[score] = count / runs
+    return probabilities, distributions
+
+EXPORT_FORMATS = {"xlsx": "xlsx", "csv": "csv", "parquet": "parquet"}
+EXPORT_COLUMNS = ["Место", "Регистрационный номер", "Баллы", "Приоритет"]
+EXPORT_BATCH = 50000  # строк в группе Parquet
+
+def _export_rows(admitted, direction_names, update_times):
+    # Строки выгрузки прямо из результатов симуляции, без промежуточных таблиц
+    for did, entries in admitted.items():
+        title = direction_names.get(did, "Без названия")
+        utime = update_times.get(did, "неизвестно")
+        for place, (reg, score, pr) in enumerate(entries, 1):
+            yield did, title, utime, place, reg, score, pr
+
+def _sheet_name(did, title):
+    safe = re.sub(r'[\\/*?:[\]]', '_', title)[:30]
+    return f"{did}-{safe}"[:31]
+
+def _write_xlsx(out, admitted, direction_names, update_times, combined):
+    # write_only: строки уходят в файл сразу, книга целиком в памяти не держится
+    wb = Workbook(write_only=True)
+    if combined:
+        ws = wb.create_sheet("Все направления")
+        ws.append(["ID", "Направление", "Время обновления"] + EXPORT_COLUMNS)
+        for row in _export_rows(admitted, direction_names, update_times):
+            ws.append(row)
+    else:
+        for did, entries in admitted.items():
+            title = direction_names.get(did, "Без названия")
+            ws = wb.create_sheet(_sheet_name(did, title))
+            ws.append([f"Название направления: {title}"])
+            ws.append([f"Время обновления: {update_times.get(did, 'неизвестно')}"])
+            ws.append([])
+            ws.append(EXPORT_COLUMNS)
+            for place, (reg, score, pr) in enumerate(entries, 1):
+                ws.append([place, reg, score, pr])
+    if not wb.worksheets:
+        wb.create_sheet("Пусто")
+    wb.save(out)
+
+def _write_csv(out, admitted, direction_names, update_times):
+    # utf-8-sig, чтобы Excel сразу открыл кириллицу
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text, delimiter=";")
+    writer.writerow(["ID", "Направление", "Время обновления"] + EXPORT_COLUMNS)
+    writer.writerows(_export_rows(admitted, direction_names, update_times))
+    text.flush()
+    text.detach()
+
+def _write_parquet(out, admitted, direction_names, update_times):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([("direction_id", pa.int32()), ("direction", pa.string()), ("update_time", pa.string()),
+                        ("place", pa.int32()), ("reg_number", pa.string()), ("total_score", pa.int32()),
+                        ("priority", pa.int32())])
+    with pq.ParquetWriter(out, schema) as writer:
+        rows = _export_rows(admitted, direction_names, update_times)
+        while True:
+            batch = list(itertools.islice(rows, EXPORT_BATCH))
+            if not batch:
+                break
+            writer.write_table(pa.Table.from_pylist(
+                [dict(zip(schema.names, row)) for row in batch], schema=schema))
+
+def export_results(admitted, direction_names, update_times, fmt="xlsx", combined=False):
+    # Выгрузка в память: возвращает (имя файла, байты). CSV и Parquet всегда
+    # одной таблицей со столбцом направления, xlsx — по листу на направление
+    # или одним листом при combined.
+    out = io.BytesIO()
+    if fmt == "xlsx":
+        _write_xlsx(out, admitted, direction_names, update_times, combined)
+    elif fmt == "csv":
+        _write_csv(out, admitted, direction_names, update_times)
+    elif fmt == "parquet":
+        _write_parquet(out, admitted, direction_names, update_times)
+    else:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    filename = f"admission_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt]}"
+    return filename, out.getvalue()
+
 def export_to_excel(admitted, direction_names, update_times):
     os.makedirs("tmp", exist_ok=True)
-    filename = f"admission_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    filename, data = export_results(admitted, direction_names, update_times)
     filepath = os.path.join("tmp", filename)
-    with pd.ExcelWriter(filepath, engine="openpyxl") as writer:
-        for did, entries in admitted.items():
-            title = direction_names.get(did, "Без названия")
-            utime = update_times.get(did, "неизвестно")
-            safe = re.sub(r'[\\/*?:[\]]', '_', title)[:30]
-            sheet = f"{did}-{safe}"[:31]
-            df = pd.DataFrame(entries, columns=["Регистрационный номер", "Баллы", "Приоритет"])
-            df.index += 1
-            df.index.name = "Место"
-            meta = pd.DataFrame([[f"Название направления: {title}"],
-                                 [f"Время обновления: {utime}"], [""]])
-            combined = pd.concat([meta, df.reset_index()], ignore_index=True)
-            combined.to_excel(writer, sheet_name=sheet, index=False)
+    with open(filepath, "wb") as f:
+        f.write(data)
     return filepath
 
+def normalize_reg(reg_number):
+    return reg_number.translate({ord(c): None for c in REG_SEPARATORS}).strip(REG_TRIM)
+
+def lookup_row(form, did, spec, pos, reg, tot, ind, orig, pr):
+    return {
+        "ID": did,
+        "Специальность": spec or "",
+        "Форма": "бюджет" if form == "budget" else "контракт",
+        "Позиция": pos,
+        "Регномер": reg,
+        "Баллы": tot,
+        "ИД": ind,
+        "Оригинал": bool(orig),
+        "Приоритет": pr
+    }
+
+def store_rows(store, reg_ids):
+    # Заявления номеров из хранилища в порядке формы и направления
+    rows = []
+    for form in ("budget", "contract"):
+        view = store["views"][form]
+        cols = view["columns"]
+        found = []
+        for rid in reg_ids:
+            found += reg_rows(view, rid)
+        for i in sorted(found):
+            did = cols["did"][i]
+            rows.append(lookup_row(form, did, store["names"].get((form, did)), cols["position"][i],
+                                   store["regs"][cols["reg"][i]], cols["score"][i], cols["ind"][i],
+                                   cols["flags"][i] & FLAG_ORIGINALS, cols["priority"][i]))
+    return rows
+
+def with_contract_margins(rows):
+    # Для заявлений на контракт — проходит ли и запас баллов из сводки
+    margins = load_contract_margins({r["Регномер"] for r in rows if r["Форма"] == "контракт"})
+    for r in rows:
+        key = (r["ID"], r["Регномер"]) if r["Форма"] == "контракт" else None
+        r["Проходит на контракт"], r["Запас баллов"] = margins.get(key, (None, None))
+    return rows
+
 def lookup_reg_number(reg_number):
-    conn = get_connection()
-    cur = conn.cursor()
+    # Номер сравнивается без разделителей: "123-456-789 00" и "12345678900" — одно и то же
+    store = get_store()
+    return with_contract_margins(store_rows(store, norm_reg_ids(store, normalize_reg(reg_number))))
+
+def lookup_reg_prefix(prefix, limit=500):
+    # Заявления всех номеров, начинающихся с prefix, по отсортированному списку номеров
+    prefix = normalize_reg(prefix)
+    if not prefix:
+        return []
+    store = get_store()
+    if store["sorted_norms"] is None:
+        store["sorted_norms"] = sorted(store["norm_ids"])
+    norms = store["sorted_norms"]
     results = []
-    for did in ID_LIST:
-        tbl = f"applicants_{did}"
-        cur.execute(
-            "SELECT position, reg_number, total_score, individual_achievements, has_originals, priority "
-            f"FROM {tbl} WHERE reg_number = ?", (reg_number,))
-        rows = cur.fetchall()
-        if rows:
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"name_{did}",))
-            spec_row = cur.fetchone()
-            spec = spec_row[0] if spec_row else ""
-            for pos, reg, tot, ind, orig, pr in rows:
-                results.append({
-                    "ID": did,
-                    "Специальность": spec,
-                    "Форма": "бюджет",
-                    "Позиция": pos,
-                    "Регномер": reg,
-                    "Баллы": tot,
-                    "ИД": ind,
-                    "Оригинал": bool(orig),
-                    "Приоритет": pr
-                })
-
-    for did in CONTRACT_ID_LIST:
-        tbl = f"contract_applicants_{did}"
-        cur.execute(
-            "SELECT position, reg_number, total_score, individual_achievements, has_originals, priority "
-            f"FROM {tbl} WHERE reg_number = ?", (reg_number,))
-        rows = cur.fetchall()
-        if rows:
-            cur.execute("SELECT value FROM metadata WHERE key = ?", (f"contract_name_{did}",))
-            spec_row = cur.fetchone()
-            spec = spec_row[0] if spec_row else ""
-            for pos, reg, tot, ind, orig, pr in rows:
-                results.append({
-                    "ID": did,
-                    "Специальность": spec,
-                    "Форма": "контракт",
-                    "Позиция": pos,
-                    "Регномер": reg,
-                    "Баллы": tot,
-                    "ИД": ind,
-                    "Оригинал": bool(orig),
-                    "Приоритет": pr
-                })
-    conn.close()
+    for k in range(bisect.bisect_left(norms, prefix), len(norms)):
+        if not norms[k].startswith(prefix) or len(results) >= limit:
+            break
+        results += store_rows(store, norm_reg_ids(store, norms[k]))
+    return with_contract_margins(results[:limit])
+
+def lookup_reg_numbers(reg_numbers):
+    # Пакетный поиск по хранилищу: {номер как передан: [заявления]}
+    store = get_store()
+    results = {reg: store_rows(store, norm_reg_ids(store, normalize_reg(reg))) for reg in reg_numbers}
+    with_contract_margins([r for rows in results.values() for r in rows])
     return results
 
 __all__ = [
-    "fetch_and_store_single", "simulate_admission", "simulate_contract",
-    "export_to_excel", "lookup_reg_number",
+    "fetch_and_store_single", "fetch_and_store_many", "simulate_admission", "simulate_contract",
+    "export_to_excel", "export_results", "lookup_reg_number", "lookup_reg_prefix", "lookup_reg_numbers",
+    "load_directions", "has_data", "data_version", "clear_data", "last_published", "load_metrics", "metrics_text",
+    "snapshot_state", "position_history", "cutoff_trend", "compact_snapshots",
+    "deferred_acceptance", "what_if", "simulate_probabilities", "admission_state",
+    "direction_ids", "load_catalog", "discover_catalog", "ensure_catalog", "rebuild_from_archive", "replay_day",
+    "load_contract_summary", "refresh_contract_summary", "contract_summary_version",
     "ID_LIST", "CONTRACT_ID_LIST"
 ]
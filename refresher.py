@@ -0,0 +1,134 @@
+import argparse
+import threading
+import time
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import core
+
+# Фоновое обновление списков без браузера:
+#   python refresher.py --interval 600
+#   python refresher.py --once --form budget
+#   python refresher.py --metrics-port 9108   # метрики Prometheus на /metrics
+#   python refresher.py --offline             # пересобрать базу из архива страниц без сети
+#   python refresher.py --replay 2026-07-25   # симуляция по страницам на конец дня
+
+def log(message):
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {message}", flush=True)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = core.metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve_metrics(port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log(f"метрики: http://{host}:{port}/metrics")
+    return server
+
+def refresh_catalog(workers=core.MAX_WORKERS, rate=core.RATE_LIMIT):
+    result = core.ensure_catalog(workers=workers, rate=rate)
+    if result is None:
+        return
+    if "error" in result:
+        log(f"каталог: не удалось обновить: {result['error']}")
+    else:
+        log(f"каталог: {result['directions']} направлений, изменилось страниц {result['changed']} "
+            f"из {result['pages']}, удалено направлений {result['removed']}")
+        if result["failed"]:
+            log(f"каталог: не получены страницы {result['failed']}")
+
+def refresh(contract, incremental=True, workers=core.MAX_WORKERS, rate=core.RATE_LIMIT):
+    ids = core.direction_ids(contract)
+    started = time.time()
+    results = core.fetch_and_store_many(ids, contract=contract, workers=workers, rate=rate,
+                                        incremental=incremental)
+    fails = [did for did in ids if not results.get(did)]
+    log(f"{core.form_name(contract)}: опубликовано {len(ids) - len(fails)} из {len(ids)} "
+        f"за {time.time() - started:.1f} с, версия данных {core.data_version()}")
+    if fails:
+        _, records = core.load_metrics(contract)
+        for r in records:
+            if r["status"] == "error":
+                log(f"{core.form_name(contract)} {r['direction_id']}: {r['stage']}: {r['error']}")
+    return not fails
+
+def rebuild(workers=None, full=False):
+    started = time.time()
+    result = core.rebuild_from_archive(workers=workers, full=full)
+    log(f"архив: опубликовано {result['published']} направлений из {result['pages']}, "
+        f"без изменений {result['unchanged']} ({result['unique']} различных страниц разобрано) за {time.time() - started:.1f} с, версия данных {core.data_version()}")
+    for form, did, error in result["failed"]:
+        log(f"{form} {did}: {error}")
+    return not result["failed"]
+
+def replay(day, workers=None):
+    result = core.replay_day(day, workers)
+    log(f"симуляция на {result['until']}: страниц в архиве {result['rebuilt']['pages']}")
+    budget = result["budget"]
+    for did in sorted(budget["places"]):
+        log(f"бюджет {did} {budget['names'][did]}: мест {budget['places'][did]}, "
+            f"проходной {budget['cutoffs'].get(did) or '—'}, список от {budget['times'][did]}")
+    contract = result["contract"]
+    for did in sorted(contract["places"]):
+        lst = contract["admitted"].get(did, [])
+        lowest = min(score for _, score, _ in lst) if lst else "—"
+        log(f"контракт {did} {contract['names'][did]}: мест {contract['places'][did]}, "
+            f"зачислено {len(lst)}, мин. балл {lowest}, список от {contract['times'][did]}")
+    return not result["rebuilt"]["failed"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Фоновое обновление рейтингов abit.susu.ru")
+    parser.add_argument("--interval", type=int, default=600, help="пауза между обновлениями, секунд")
+    parser.add_argument("--once", action="store_true", help="обновить один раз и выйти")
+    parser.add_argument("--form", choices=["budget", "contract", "all"], default="all")
+    parser.add_argument("--full", action="store_true", help="перезаписывать все списки, а не только изменившиеся")
+    parser.add_argument("--workers", type=int, default=core.MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=core.RATE_LIMIT, help="запросов в секунду, 0 — без ограничения")
+    parser.add_argument("--db", default=core.DB_PATH)
+    parser.add_argument("--metrics-log", default=core.METRICS_LOG, help="журнал замеров в формате JSON lines")
+    parser.add_argument("--metrics-port", type=int, help="порт для метрик Prometheus")
+    parser.add_argument("--archive", default=core.ARCHIVE_DIR, help="каталог архива страниц, пустая строка — не хранить")
+    parser.add_argument("--offline", action="store_true", help="пересобрать базу из архива и выйти")
+    parser.add_argument("--replay", metavar="ГГГГ-ММ-ДД", help="симуляция по страницам архива на конец дня")
+    args = parser.parse_args()
+
+    core.DB_PATH = args.db
+    core.METRICS_LOG = args.metrics_log
+    core.ARCHIVE_DIR = args.archive
+    if args.offline:
+        raise SystemExit(0 if rebuild(full=args.full) else 1)
+    if args.replay:
+        raise SystemExit(0 if replay(args.replay) else 1)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    forms = {"budget": [False], "contract": [True], "all": [False, True]}[args.form]
+    while True:
+        ok = True
+        refresh_catalog(args.workers, args.rate or None)
+        for contract in forms:
+            try:
+                ok = refresh(contract, not args.full, args.workers, args.rate or None) and ok
+            except Exception as e:
+                ok = False
+                log(f"{core.form_name(contract)}: обновление прервано: {e}")
+        if args.once:
+            raise SystemExit(0 if ok else 1)
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,22 @@
+import pytest
+import core
+
+# Уровень образования в каталоге определяется по целым словам
+
+@pytest.mark.parametrize("text, expected", [
+    ("Магистратура 23.04.03 Эксплуатация транспортно-технологических машин и комплексов", True),
+    ("23.04.03 Эксплуатация транспортно-технологических машин и комплексов", True),
+    ("49.04.01 Физическая культура. Спорт высших достижений", True),
+    ("Магистральный транспорт", True),
+    ("Программы магистров", True),
+    ("Магистратура и бакалавриат", True),
+    ("Бакалавриат 23.03.01 Технология транспортных процессов", False),
+    ("Магистральные сети (бакалавриат)", False),
+    ("СПО: Организация перевозок на транспорте", False),
+    ("Специалитет", False),
+    ("Аспирантура", False),
+    ("Ординатура", False),
+    ("Колледж", False),
+])
+def test_level_matches(text, expected):
+    assert core.level_matches(text) is expected
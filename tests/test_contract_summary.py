@@ -0,0 +1,68 @@
+import pytest
+import core
+
+# Проходной балл на контракт считается по заявлениям, а не по договорам;
+# запас баллов есть только у участвующих в заполнении
+
+SIGNED, APPLIED, GENERAL = "Заключен договор", "Подано заявление", "Общий конкурс"
+
+def row(position, reg, place_type, score, originals=0):
+    return (position, reg, place_type, score, 0, originals, 1, None)
+
+def store(conn, did, contract, places, rows):
+    core.store_direction(conn, did, contract, (places, f"Направление {did}", "01.08.2025 10:00", rows,
+                                               ("01.08.2025 10:00", str(did), None, None)))
+
+@pytest.fixture
+def summary(tmp_path):
+    with core.use_database(str(tmp_path / "abit.db")):
+        conn = core.get_connection()
+        store(conn, 2, False, 1, [row(1, "X", GENERAL, 300, 1)])
+        store(conn, 2, True, 3, [
+            row(1, "S", SIGNED, 100), row(2, "X", APPLIED, 300), row(3, "N", GENERAL, 400),
+            row(4, "A1", APPLIED, 250), row(5, "A2", APPLIED, 180), row(6, "A3", APPLIED, 150),
+        ])
+        store(conn, 6, True, 2, [
+            row(1, "S1", SIGNED, 90), row(2, "S2", SIGNED, 80), row(3, "S3", SIGNED, 70),
+            row(4, "B", APPLIED, 200),
+        ])
+        conn.close()
+        core.refresh_contract_summary()
+        yield ({s["direction_id"]: s for s in core.load_contract_summary()},
+               core.load_contract_margins(["S", "X", "N", "A1", "A2", "A3", "S1", "B"]))
+
+def test_cutoff_from_applications(summary):
+    directions, margins = summary
+    assert directions[2]["cutoff"] == 180
+    assert (directions[2]["signed"], directions[2]["admitted"], directions[2]["free_places"]) == (1, 3, 0)
+    assert margins[2, "A1"] == (True, 70)
+    assert margins[2, "A2"] == (True, 0)
+    assert margins[2, "A3"] == (False, -30)
+    assert margins[2, "S"] == (True, -80)
+
+def test_no_margin_outside_competition(summary):
+    _, margins = summary
+    assert margins[2, "X"] == (False, None)
+    assert margins[2, "N"] == (False, None)
+
+def test_signed_fill_all_places(summary):
+    directions, margins = summary
+    assert directions[6]["cutoff"] is None
+    assert directions[6]["admitted"] == 3
+    assert margins[6, "B"] == (False, None)
+    assert margins[6, "S1"] == (True, None)
+
+def test_readers_do_not_rebuild(summary, monkeypatch):
+    directions, _ = summary
+    conn = core.get_connection()
+    store(conn, 6, True, 4, [row(1, "S1", SIGNED, 90), row(2, "B", APPLIED, 200)])
+    conn.close()
+    monkeypatch.setattr(core, "refresh_contract_summary", lambda: pytest.fail("читатель пересчитал сводку"))
+    assert core.contract_summary_version() != core.data_version()
+    assert {s["direction_id"]: s for s in core.load_contract_summary()} == directions
+    assert core.load_contract_margins(["B"]) == {}
+
+def test_writers_refresh(summary):
+    core.clear_data(True)
+    assert core.contract_summary_version() == core.data_version()
+    assert all(s["signed"] == 0 and s["admitted"] == 0 for s in core.load_contract_summary())
@@ -0,0 +1,60 @@
+import random
+import pytest
+import core
+
+# Отложенное принятие: итог устойчив, порядок на направлении — баллы, ИД, позиция
+
+def applications(rng, places):
+    apps, positions = [], {did: rng.sample(range(1, 200), 60) for did in places}
+    for k in range(60):
+        reg, score, ind, orig = f"{k:03d}", rng.randint(60, 70), rng.randint(0, 2), rng.random() < 0.5
+        for pr, did in enumerate(rng.sample(sorted(places), rng.randint(1, len(places))), 1):
+            apps.append((reg, did, pr, score, ind, positions[did][k], orig))
+    return apps
+
+def rank(app):
+    return app[3], app[4], -app[5]
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("originals_only", [False, True])
+def test_stable(seed, originals_only):
+    rng = random.Random(seed)
+    places = {did: rng.randint(0, 6) for did in (2, 7, 8, 9)}
+    apps = applications(rng, places)
+    admitted, cutoffs = core.deferred_acceptance(apps, places, originals_only)
+    seat = {reg: did for did, lst in admitted.items() for reg, *_ in lst}
+    by_key = {(a[0], a[1]): a for a in apps}
+    for did, lst in admitted.items():
+        assert len(lst) <= places[did]
+        assert cutoffs[did] == (min(score for _, score, _ in lst) if len(lst) == places[did] > 0 else None)
+    for app in apps:
+        reg, did, pr, *_, orig = app
+        if places[did] == 0 or (originals_only and not orig):
+            assert seat.get(reg) != did
+            continue
+        if reg in seat and by_key[reg, seat[reg]][2] <= pr:
+            continue
+        # Абитуриент хочет сюда больше, чем туда, где он сейчас: значит, все
+        # места заняты теми, кто выше него в рейтинге направления
+        assert len(admitted[did]) == places[did]
+        assert all(rank(by_key[other, did]) > rank(app) for other, *_ in admitted[did])
+
+def test_tie_break():
+    places = {2: 1, 7: 1, 8: 1}
+    apps = [
+        ("A", 2, 1, 250, 5, 4, True), ("B", 2, 1, 260, 0, 9, True),  # баллы
+        ("C", 7, 1, 250, 3, 4, True), ("D", 7, 1, 250, 4, 9, True),  # затем ИД
+        ("E", 8, 1, 250, 3, 2, True), ("F", 8, 1, 250, 3, 1, True),  # затем позиция
+    ]
+    admitted, cutoffs = core.deferred_acceptance(apps, places)
+    assert {did: [reg for reg, *_ in lst] for did, lst in admitted.items()} == {2: ["B"], 7: ["D"], 8: ["F"]}
+    assert cutoffs == {2: 260, 7: 250, 8: 250}
+
+def test_displaced_applicant_moves_down():
+    # Сильный абитуриент со вторым приоритетом вытесняет слабого с первым
+    places = {2: 1, 7: 1}
+    apps = [("A", 2, 1, 280, 0, 1, True), ("A", 7, 2, 280, 0, 1, True),
+            ("B", 7, 1, 300, 0, 2, True), ("B", 2, 2, 300, 0, 2, True),
+            ("C", 7, 1, 310, 0, 3, True)]
+    admitted, _ = core.deferred_acceptance(apps, places)
+    assert {did: [reg for reg, *_ in lst] for did, lst in admitted.items()} == {2: ["B"], 7: ["C"]}
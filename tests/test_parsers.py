@@ -0,0 +1,55 @@
+import pytest
+import core
+from bench.pages import load_fixture, scale_page, pool_for
+
+# Разбор через lxml должен давать ровно то же, что и через BeautifulSoup
+
+def assert_same(html):
+    assert core.parse_page_bs4(html) == core.parse_page_lxml(html)
+
+@pytest.mark.parametrize("contract", [False, True])
+def test_fixture(contract):
+    html = load_fixture(contract)
+    assert_same(html)
+    assert len(core.parse_page_lxml(html)[3]) > 0
+
+@pytest.mark.parametrize("contract", [False, True])
+@pytest.mark.parametrize("scale", [1, 5])
+def test_scaled_page(contract, scale):
+    ids = [7, 12, 45]
+    assert_same(scale_page(ids[0], contract, scale, pool_for(ids, scale)))
+
+def test_comments():
+    html = load_fixture()
+    html = html.replace('<p><b>Всего мест: 7</b></p>', '<!-- <p><b>Всего мест: 99</b></p> --><p><b>Всего мест: 7</b></p>')
+    html = html.replace('<span class="mobile-label">Сумма оценок:</span> 100',
+                        '<span class="mobile-label">Сумма оценок:</span> <!-- старое: 90 -->100', 1)
+    html = html.replace("<b>28.07.2025 15:00</b>", "<b><!-- 27.07 -->28.07.2025 15:00</b>")
+    assert_same(html)
+    places, _, update_time, rows = core.parse_page_lxml(html)
+    assert (places, update_time, rows[0][3]) == (7, "28.07.2025 15:00", 100)
+
+def test_shy_entity():
+    html = load_fixture().replace("\xad", "&shy;")
+    assert "&shy;" in html
+    assert_same(html)
+    assert core.parse_page_lxml(html)[3] == core.parse_page_lxml(load_fixture())[3]
+
+def test_missing_tbody():
+    html = load_fixture().replace("<tbody>", "").replace("</tbody>", "")
+    for parse in (core.parse_page_bs4, core.parse_page_lxml):
+        with pytest.raises(ValueError):
+            parse(html)
+
+def test_extra_class_names():
+    html = (load_fixture()
+            .replace('class="rating_info"', 'class="col rating_info  wide"')
+            .replace('class="rating_time"', 'class="rating_time text-muted"'))
+    assert_same(html)
+    _, name, update_time, _ = core.parse_page_lxml(html)
+    assert name != "Без названия" and update_time != "неизвестно"
+
+def test_no_metadata():
+    html = load_fixture().replace('class="rating_info"', 'class="rating_information"')
+    assert_same(html)
+    assert core.parse_page_lxml(html)[1] == "Без названия"
@@ -0,0 +1,46 @@
+import random
+import pytest
+import core
+
+# Без случайности (все подают оригиналы, никто не отзывает, все заявления
+# становятся договорами) Монте-Карло должен повторять обычную симуляцию
+
+BUDGET = {2: 3, 7: 2, 8: 4}
+CONTRACT = {2: 3, 6: 2}
+
+def lists(rng):
+    regs = [f"{k:03d}-000-000 00" for k in range(40)]
+    budget, contract = {did: [] for did in BUDGET}, {did: [] for did in CONTRACT}
+    for reg in regs:
+        score = rng.randint(60, 100)
+        for priority, did in enumerate(rng.sample(sorted(BUDGET), rng.randint(1, 3)), 1):
+            budget[did].append([reg, "Общий конкурс", score, rng.randint(0, 3), rng.random() < 0.5, priority])
+        for did in rng.sample(sorted(CONTRACT), rng.randint(0, 2)):
+            ptype = rng.choice(["Заключен договор", "Подано заявление", "Подано заявление", "По договору"])
+            contract[did].append([reg, ptype, score, 0, False, rng.randint(1, 3)])
+    return budget, contract
+
+def store(conn, contract, places, lists):
+    for did, entries in lists.items():
+        entries.sort(key=lambda e: (-e[2], -e[3]))
+        rows = [(k, reg, ptype, score, ind, int(orig), pr, None)
+                for k, (reg, ptype, score, ind, orig, pr) in enumerate(entries, 1)]
+        core.store_direction(conn, did, contract, (places[did], f"Направление {did}", "01.08.2025 10:00", rows,
+                                                   ("01.08.2025 10:00", str(did), None, None)))
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_deterministic_runs_match_simulation(tmp_path, seed):
+    budget, contract = lists(random.Random(seed))
+    with core.use_database(str(tmp_path / "abit.db")):
+        conn = core.get_connection()
+        store(conn, False, BUDGET, budget)
+        store(conn, True, CONTRACT, contract)
+        conn.close()
+        admitted, cutoffs = core.simulate_admission(BUDGET)
+        contract_admitted = core.simulate_contract(admitted, CONTRACT)
+        probs, dists = core.simulate_probabilities(BUDGET, CONTRACT, runs=4, p_originals=1, p_withdraw=0,
+                                                   p_contract=1, workers=1)
+    expected = {("budget", did, reg): 1.0 for did, lst in admitted.items() for reg, *_ in lst}
+    expected.update({("contract", did, reg): 1.0 for did, lst in contract_admitted.items() for reg, *_ in lst})
+    assert probs == expected
+    assert {did: dists["budget", did] for did in BUDGET} == {did: {cutoff: 1.0} for did, cutoff in cutoffs.items()}
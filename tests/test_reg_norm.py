@@ -0,0 +1,33 @@
+import sqlite3
+import pytest
+import core
+
+# Номер СНИЛС нормализуется одинаково в Python и в вычисляемом столбце SQLite
+
+@pytest.mark.parametrize("reg", ["123-456-789 00", " 123-456-789 00\r\n", "\n12345678900\t", "123.456.789 00",
+                                 "\v123 456 789 00\f", "a\nb"])
+def test_sql_matches_python(reg):
+    conn = sqlite3.connect(":memory:")
+    assert conn.execute(f"SELECT {core.reg_norm_sql('?')}", (reg,)).fetchone()[0] == core.normalize_reg(reg)
+
+def test_old_column_is_rebuilt(tmp_path):
+    with core.use_database(str(tmp_path / "abit.db")):
+        conn = core.get_connection()
+        # Схема первой версии: старое выражение и индекс по applicants
+        conn.execute("DROP INDEX idx_snapshot_rows_reg_norm")
+        conn.execute("ALTER TABLE snapshot_rows DROP COLUMN reg_norm")
+        conn.execute("ALTER TABLE snapshot_rows ADD COLUMN reg_norm TEXT GENERATED ALWAYS AS "
+                     "(replace(reg_number, '-', '')) VIRTUAL")
+        conn.execute("ALTER TABLE applicants ADD COLUMN reg_norm TEXT GENERATED ALWAYS AS "
+                     "(replace(reg_number, '-', '')) VIRTUAL")
+        conn.execute("CREATE INDEX idx_applicants_reg_norm ON applicants (reg_norm)")
+        conn.execute("PRAGMA user_version = 1")
+        conn.close()
+        conn = core.get_connection()
+        core.store_direction(conn, 2, False, (1, "Направление 2", "01.08.2025 10:00",
+                                              [(1, "123-456-789 00\n", "Общий конкурс", 250, 0, 1, 1, None)],
+                                              ("01.08.2025 10:00", "hash", None, None)))
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        conn.close()
+        assert "idx_applicants_reg_norm" not in indexes and "idx_snapshot_rows_reg_norm" in indexes
+        assert len(core.position_history(" 12345678900")) == 1
@@ -0,0 +1,55 @@
+from datetime import datetime
+import pytest
+import core
+
+# Версии списка после чистки должны восстанавливаться такими же, какими были записаны
+
+def row(position, reg, score):
+    return (position, reg, "Общий конкурс", score, 0, 0, 1, None)
+
+A, B, C, D = row(1, "A", 250), row(2, "B", 240), row(3, "C", 230), row(3, "D", 220)
+A2 = row(1, "A", 260)
+
+VERSIONS = [
+    ("01.07.2025 10:00", [A, B, C]),
+    ("01.07.2025 18:00", [A, B]),
+    ("02.07.2025 18:00", [A, B, D]),
+    ("03.07.2025 10:00", [A]),  # полная копия
+    ("03.07.2025 18:00", [A2]),
+]
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "SNAPSHOT_KEYFRAME_EVERY", 3)
+    with core.use_database(str(tmp_path / "abit.db")):
+        conn = core.get_connection()
+        for update_time, rows in VERSIONS:
+            core.store_direction(conn, 1, False, (7, "Направление", update_time, rows,
+                                                  (update_time, update_time, None, None)), incremental=True)
+        conn.close()
+        yield
+
+def full_flags():
+    conn = core.get_connection()
+    flags = [f for f, in conn.execute("SELECT is_full FROM snapshots ORDER BY snapshot_id")]
+    conn.close()
+    return flags
+
+def removals(reg):
+    return [(h["taken_at"], h["removed"]) for h in core.position_history(reg) if h["removed"]]
+
+def test_full_snapshot_resets_state(db):
+    assert full_flags() == [1, 0, 0, 1, 0]
+    assert core.snapshot_state("budget", 1) == [A2]
+    assert core.snapshot_state("budget", 1, "2025-07-02 23:00:00") == [A, B, D]
+    assert removals("B") == [("2025-07-03 10:00:00", True)]
+    assert removals("D") == [("2025-07-03 10:00:00", True)]
+
+def test_compact_after_full_snapshot(db):
+    assert core.compact_snapshots(now=datetime(2025, 8, 1)) == 2
+    assert full_flags() == [1, 0, 0]
+    assert core.snapshot_state("budget", 1) == [A2]
+    assert core.snapshot_state("budget", 1, "2025-07-02 23:00:00") == [A, B, D]
+    assert core.snapshot_state("budget", 1, "2025-07-01 23:00:00") == [A, B]
+    assert removals("B") == [("2025-07-03 18:00:00", True)]
+    assert removals("D") == [("2025-07-03 18:00:00", True)]
@@ -0,0 +1,54 @@
+import pytest
+import core
+
+# Хранилище в памяти должно следовать за базой при каждой записи
+
+def row(position, reg, score):
+    return (position, reg, "Общий конкурс", score, 0, 1, 1, None)
+
+def store(did, rows, content_hash="same", incremental=True):
+    conn = core.get_connection()
+    core.publish_staged(conn, False, {did: (1, f"Направление {did}", "01.08.2025 10:00", rows,
+                                            ("01.08.2025 10:00", content_hash, None, None))}, incremental)
+    conn.close()
+
+def scores(reg):
+    return [r["Баллы"] for r in core.lookup_reg_number(reg)]
+
+@pytest.fixture
+def db(tmp_path):
+    with core.use_database(str(tmp_path / "abit.db")):
+        store(2, [row(1, "A", 200), row(2, "B", 100)])
+        store(7, [row(1, "C", 150)], "other")
+        yield
+
+def test_same_fingerprint_new_rows(db):
+    assert scores("A") == [200]
+    admitted, _ = core.simulate_admission({2: 1, 7: 1})
+    assert [reg for reg, *_ in admitted[2]] == ["A"]
+    # Тот же хеш, время и число строк — как при повторном разборе архива
+    store(2, [row(1, "B", 300), row(2, "A", 50)])
+    assert scores("A") == [50]
+    assert scores("B") == [300]
+    admitted, _ = core.simulate_admission({2: 1, 7: 1})
+    assert [reg for reg, *_ in admitted[2]] == ["B"]
+
+def test_incremental_rebuild(db):
+    old = core.get_store()
+    old_budget = old["views"]["budget"]
+    store(2, [row(1, "A", 200), row(2, "D", 120)], "new")
+    new = core.get_store()
+    assert new is not old and new["version"] > old["version"]
+    # Прежняя версия не меняется: её могут читать другие сессии
+    assert old["views"]["budget"] is old_budget and "D" not in old["reg_ids"]
+    assert list(old_budget["columns"]["score"]) == [200, 100, 150]
+    cols = new["views"]["budget"]["columns"]
+    assert [(new["regs"][rid], score) for rid, score in zip(cols["reg"], cols["score"])] == \
+        [("A", 200), ("D", 120), ("C", 150)]
+    assert new["views"]["budget"]["offsets"] == {2: (0, 2), 7: (2, 3)}
+    assert scores("B") == [] and scores("D") == [120] and scores("C") == [150]
+
+def test_cleared_form(db):
+    core.get_store()
+    core.clear_data(False)
+    assert scores("A") == [] and core.get_store()["views"]["budget"]["offsets"] == {}
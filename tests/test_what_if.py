@@ -0,0 +1,78 @@
+import random
+import pytest
+import core
+
+# what_if должен давать то же, что полный пересчёт с изменёнными заявлениями
+
+PLACES = {2: 3, 7: 2, 8: 4, 9: 0}
+
+def applications(rng):
+    apps, positions = [], {did: rng.sample(range(1, 100), 40) for did in PLACES}
+    for k in range(40):
+        reg, score, ind, orig = f"{k:03d}", rng.randint(60, 100), rng.randint(0, 3), rng.random() < 0.5
+        for pr, did in enumerate(rng.sample(sorted(PLACES), rng.randint(1, 4)), 1):
+            apps.append((reg, did, pr, score, ind, positions[did][k], orig))
+    return apps
+
+def change(rng, apps, reg):
+    dids = [a[1] for a in apps if a[0] == reg]
+    kind = rng.choice(["priorities", "score", "originals", "add", "withdraw", "withdraw_all"])
+    if kind == "priorities":
+        return {"priorities": {did: rng.randint(1, 5) for did in rng.sample(dids, rng.randint(1, len(dids)))}}
+    if kind == "score":
+        return {"score": rng.randint(50, 110)}
+    if kind == "originals":
+        return {"originals": rng.random() < 0.5}
+    if kind == "add":
+        free = [did for did in PLACES if did not in dids]
+        return {"add": [(did, rng.randint(1, 5)) for did in free[:rng.randint(1, 2)]]}
+    if kind == "withdraw":
+        return {"withdraw": rng.sample(dids, 1)}
+    return {"withdraw": True}
+
+def rebuild(apps, reg, priorities=None, score=None, originals=None, add=None, withdraw=None):
+    rows = [a for a in apps if a[0] == reg]
+    new = [a for a in apps if a[0] != reg]
+    for _, did, pr, sc, ind, pos, orig in rows:
+        if withdraw is True or (withdraw and did in withdraw):
+            continue
+        new.append((reg, did, (priorities or {}).get(did, pr), sc if score is None else score, ind, pos,
+                    orig if originals is None else originals))
+    sc, ind, orig = (rows[0][3], rows[0][4], rows[0][6]) if rows else (0, 0, False)
+    for did, pr in add or []:
+        new.append((reg, did, pr, sc if score is None else score, ind, 10 ** 9,
+                    orig if originals is None else originals))
+    return new
+
+def admitted(state):
+    return {did: {reg for reg, *_ in lst} for did, lst in core.admission_results(state)[0].items()}
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("originals_only", [False, True])
+def test_matches_full_rebuild(seed, originals_only):
+    rng = random.Random(seed)
+    apps = applications(rng)
+    state = core.build_admission_state(apps, PLACES, originals_only)
+    before = admitted(state)
+    for _ in range(30):
+        reg = rng.choice(sorted({a[0] for a in apps}))
+        delta = change(rng, apps, reg)
+        expected = core.build_admission_state(rebuild(apps, reg, **delta), PLACES, originals_only)
+        result = core.what_if(reg, state=state, **delta)
+        after = admitted(expected)
+        assert result["after"] == core.admission_outcome(expected, reg)
+        assert result["changed"] == {did: {"added": sorted(after[did] - before[did]),
+                                           "removed": sorted(before[did] - after[did])}
+                                     for did in after if after[did] != before[did]}
+    assert admitted(state) == before
+
+def test_commit_and_new_applicant():
+    rng = random.Random(1)
+    apps = applications(rng)
+    state = core.build_admission_state(apps, PLACES)
+    core.what_if("000", score=200, state=state, commit=True)
+    apps = rebuild(apps, "000", score=200)
+    assert admitted(state) == admitted(core.build_admission_state(apps, PLACES))
+    result = core.what_if("new", score=300, add=[(7, 1)], state=state)
+    assert result["before"] is None and result["after"] == (7, 1, 300)
+    assert result["changed"][7]["added"] == ["new"]